@@ -0,0 +1,561 @@
+"""
+A local load generator for the trivia servers.
+Starts server_io.py (eventlet WSGI) and/or server_asgi.py (asyncio ASGI) on the loopback,
+and measures connections per second and play_question round-trip latency.
+With --flood, extra clients fire play_question as fast as they can while the
+measured clients keep a human pace, to check the rate limiter keeps their latency bounded.
+The time from launching a server to its first accepted connection is reported as well.
+The memory mode compares the resident memory of the questions bank as a pandas data frame
+and as a question_store.QuestionStore, in memory and memory-mapped.
+The payload mode has logged-in clients fire bursts of list-heavy events (highscore, stats,
+logged-in users), and compares the frames and bytes they receive with every response in its own
+uncompressed frame, and with responses coalesced and compressed (see response_batcher.py).
+The answers mode has logged-in clients of a large league play questions and answer them,
+and compares the answers per second with the players csv saved every group commit
+and every score_buffer.SAVE_INTERVAL.
+
+usage: python bench_io.py [wsgi|asgi|both] [--clients N] [--events N] [--flood N] [--max-p99 MS]
+                          [--startup-budget MS]
+       python bench_io.py memory [--questions N]
+       python bench_io.py payload [--clients N] [--events N] [--interval S]
+       python bench_io.py answers [--clients N] [--events N] [--interval S] [--players N]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import socketio
+
+import helpers
+import response_batcher
+import score_buffer
+
+###############
+### GLOBALS ###
+###############
+
+HOST = '127.0.0.1'
+PORT = 8080
+URL = f'http://{HOST}:{PORT}'
+SERVERS = {'wsgi': 'server_io.py', 'asgi': 'server_asgi.py'}
+PLAYERS_CSV_HEADER = 'username,password,score,is_manager,id,sid,games_played,wins_in_row\n'
+STARTUP_TIMEOUT = 60
+CALLBACK_TIMEOUT = 10
+CONNECT_CONCURRENCY = 50
+FLOOD_INTERVAL = 0.001  # seconds between a flood client's events
+FLOOD_WARMUP = 1  # seconds the flood runs before the measured clients start
+PAYLOAD_BURST = ['server_highscore', 'server_stats', 'logged_in_users']
+PAYLOAD_VARIANTS = {'plain': ({response_batcher.COALESCE_ENV: '0'}, False), 'batched': ({}, True)}
+ANSWER_PLAYERS = 5000  # players of the answers mode's league, all rewritten on every save of its csv file
+ANSWER_VARIANTS = {'save every flush': {score_buffer.SAVE_ENV: str(score_buffer.FLUSH_INTERVAL)},
+                   'save interval': {}}
+
+
+########################
+### SERVER LIFECYCLE ###
+########################
+
+async def wait_for_server(url: str, timeout: float) -> float:
+    """
+    retries connecting until the server accepts a socket-io connection,
+    then waits until it's done warming up (the anonymous play_question is then answered with an error)
+    :return: the perf_counter time of the first accepted connection
+    """
+    deadline = time.perf_counter() + timeout
+    client = BenchClient(CALLBACKS)
+    while True:
+        try:
+            await client.sio.connect(url, transports=['websocket'], wait_timeout=1)
+            break
+        except socketio.exceptions.ConnectionError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.01)
+    first_connection = time.perf_counter()
+
+    await client.request('play_question')
+    # a loader that takes long gets the probe throttled too
+    while client.last_event in ('warming_up_callback', 'throttled_callback') and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+        await client.request('play_question')
+    await client.sio.disconnect()
+    return first_connection
+
+
+def start_server(mode: str, csv_path: str, env: dict | None = None) -> tuple[subprocess.Popen, float]:
+    """
+    :param env: environment variables to set for the server
+    :return: the server process, and the seconds from its launch to its first accepted connection
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    launch = time.perf_counter()
+    server = subprocess.Popen([sys.executable, SERVERS[mode], csv_path], cwd=here, env={**os.environ, **(env or {})},
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        first_connection = asyncio.run(wait_for_server(URL, STARTUP_TIMEOUT))
+    except Exception:
+        server.kill()
+        raise RuntimeError(f'{SERVERS[mode]} did not accept connections on {URL}')
+    return server, first_connection - launch
+
+
+def write_players(csv_path: str, usernames: list[str]) -> None:
+    """
+    writes a players csv file of regular players with the password 'pw' and random scores
+    """
+    with open(csv_path, 'w') as csv_file:
+        csv_file.write(PLAYERS_CSV_HEADER)
+        csv_file.writelines(f'{username},pw,{random.randrange(1000)},False,{i + 1},,0,0\n'
+                            for i, username in enumerate(usernames))
+
+
+def stop_server(server: subprocess.Popen) -> None:
+    server.terminate()
+    try:
+        server.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+######################
+### LOAD GENERATOR ###
+######################
+
+class BenchClient:
+    """
+    a socket-io client measuring the time from an emit to its callback event,
+    and the frames and bytes it receives
+    """
+
+    def __init__(self, callbacks: list[str], batches: bool = False):
+        self.sio = socketio.AsyncClient()
+        self.auth = response_batcher.BATCH_AUTH if batches else None
+        self.pending = None
+        self.outstanding = 0  # callbacks {pending} still waits for
+        self.last_data = None
+        self.last_event = None
+        self.received = {callback: 0 for callback in callbacks}
+        self.frames = 0
+        self.frame_bytes = 0
+        for callback in callbacks:
+            self.sio.on(callback, self.make_callback(callback))
+        self.sio.on(response_batcher.BATCH_EVENT, self.on_batch)
+
+    def make_callback(self, callback: str):
+        async def on_callback(data=None) -> None:
+            self.count_frame(callback, data)
+            self.on_response(callback, data)
+        return on_callback
+
+    async def on_batch(self, data) -> None:
+        self.count_frame(response_batcher.BATCH_EVENT, data)
+        for callback, response in response_batcher.unpack(data):
+            self.on_response(callback, response)
+
+    def count_frame(self, event: str, data) -> None:
+        """
+        counts the websocket messages and bytes of a socket-io packet:
+        an event packet, plus an attachment message when its data is binary
+        """
+        if isinstance(data, bytes):
+            self.frames += 2
+            self.frame_bytes += len(f'451-["{event}",{{"_placeholder":true,"num":0}}]') + len(data)
+        else:
+            self.frames += 1
+            self.frame_bytes += 2 + len(json.dumps([event, data], separators=(',', ':')).encode())
+
+    def on_response(self, callback: str, data) -> None:
+        self.received[callback] = self.received.get(callback, 0) + 1
+        self.last_event = callback
+        self.last_data = data
+        self.outstanding -= 1
+        if self.outstanding <= 0 and self.pending is not None and not self.pending.done():
+            self.pending.set_result(time.perf_counter())
+
+    async def connect(self, url: str, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            await self.sio.connect(url, transports=['websocket'], auth=self.auth)
+
+    async def request(self, event: str, data=None) -> float:
+        """
+        emits an event and waits for its callback
+        :return: the round-trip latency in seconds
+        """
+        return await self.burst([(event, data)])
+
+    async def burst(self, events: list[tuple[str, str | None]]) -> float:
+        """
+        emits (event, data) pairs back to back and waits for all their callbacks
+        :return: the time from the first emit to the last callback, in seconds
+        """
+        self.pending = asyncio.get_running_loop().create_future()
+        self.outstanding = len(events)
+        start = time.perf_counter()
+        for event, data in events:
+            await self.sio.emit(event, data)
+        end = await asyncio.wait_for(self.pending, CALLBACK_TIMEOUT)
+        return end - start
+
+    async def login(self, username: str) -> None:
+        fields = {'username': username, 'password': 'pw', 'user_type': '1'}
+        await self.request('login', helpers.build_json_msg('login', 'client', fields))
+
+    async def run(self, event: str, events: int, interval: float) -> list[float]:
+        latencies = []
+        for _ in range(events):
+            latencies.append(await self.request(event))
+            await asyncio.sleep(interval)
+        return latencies
+
+    async def flood(self, event: str, stop) -> None:
+        """
+        emits {event} without waiting for callbacks until {stop} is set
+        """
+        while not stop.is_set():
+            await self.sio.emit(event)
+            await asyncio.sleep(FLOOD_INTERVAL)
+
+
+CALLBACKS = ['play_question_callback', 'error_callback', 'throttled_callback', 'throttle_stats_callback',
+             'warming_up_callback', 'login_callback', 'stats_callback', 'highscore_callback',
+             'get_logged_in_callback', 'answer_callback']
+
+
+async def run_flood(url: str, clients: int, stop) -> None:
+    flood_clients = [BenchClient(CALLBACKS) for _ in range(clients)]
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    await asyncio.gather(*[c.connect(url, semaphore) for c in flood_clients])
+    await asyncio.gather(*[c.login(f'flooder{i}') for i, c in enumerate(flood_clients)])
+    await asyncio.gather(*[c.flood('play_question', stop) for c in flood_clients])
+    await asyncio.gather(*[c.sio.disconnect() for c in flood_clients])
+
+
+def flood_process(url: str, clients: int, stop) -> None:
+    """
+    runs the flood clients in their own process, so they don't starve the measured clients' event loop
+    """
+    asyncio.run(run_flood(url, clients, stop))
+
+
+async def run_load(url: str, clients: int, events: int, flood: int = 0, interval: float = 0) -> dict:
+    bench_clients = [BenchClient(CALLBACKS) for _ in range(clients)]
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[c.connect(url, semaphore) for c in bench_clients])
+    connect_time = time.perf_counter() - start
+    await asyncio.gather(*[c.login(f'player{i}') for i, c in enumerate(bench_clients)])
+
+    stop_flood = multiprocessing.Event()
+    flooder = multiprocessing.Process(target=flood_process, args=(url, flood, stop_flood))
+    if flood:
+        flooder.start()
+        await asyncio.sleep(FLOOD_WARMUP)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[c.run('play_question', events, interval) for c in bench_clients])
+    events_time = time.perf_counter() - start
+
+    stop_flood.set()
+    if flood:
+        await asyncio.get_running_loop().run_in_executor(None, flooder.join)
+    await bench_clients[0].request('server_throttle_stats')
+    throttle_stats = json.loads(bench_clients[0].last_data)['msg']
+
+    await asyncio.gather(*[c.sio.disconnect() for c in bench_clients])
+
+    latencies = sorted(latency for result in results for latency in result)
+    return {'conn/s': clients / connect_time,
+            'events/s': len(latencies) / events_time,
+            'mean ms': statistics.mean(latencies) * 1000,
+            'p50 ms': latencies[len(latencies) // 2] * 1000,
+            'p99 ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+            'throttled': sum(c.received['throttled_callback'] for c in bench_clients),
+            'server thr': throttle_stats['throttled_total'] + throttle_stats['shed_total']}
+
+
+def bench_mode(mode: str, clients: int, events: int, flood: int, interval: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'players.csv')
+        write_players(csv_path, [f'player{i}' for i in range(clients)] + [f'flooder{i}' for i in range(flood)])
+        server, startup = start_server(mode, csv_path)
+        try:
+            results = asyncio.run(run_load(URL, clients, events, flood, interval))
+            results['startup ms'] = startup * 1000
+            return results
+        finally:
+            stop_server(server)
+
+
+#######################
+### PAYLOAD SAVINGS ###
+#######################
+
+async def run_payload(url: str, clients: int, rounds: int, interval: float, batches: bool) -> dict:
+    bench_clients = [BenchClient(CALLBACKS, batches) for _ in range(clients)]
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    await asyncio.gather(*[c.connect(url, semaphore) for c in bench_clients])
+    for i, client in enumerate(bench_clients):
+        await client.login(f'player{i}')
+    for client in bench_clients:
+        client.frames = client.frame_bytes = 0
+
+    async def run_rounds(client: BenchClient) -> list[float]:
+        latencies = []
+        for _ in range(rounds):
+            latencies.append(await client.burst([(event, None) for event in PAYLOAD_BURST]))
+            await asyncio.sleep(interval)
+        return latencies
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[run_rounds(c) for c in bench_clients])
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*[c.sio.disconnect() for c in bench_clients])
+
+    latencies = sorted(latency for result in results for latency in result)
+    responses = clients * rounds * len(PAYLOAD_BURST)
+    frames = sum(c.frames for c in bench_clients)
+    frame_bytes = sum(c.frame_bytes for c in bench_clients)
+    return {'frames/resp': frames / responses,
+            'bytes/resp': frame_bytes / responses,
+            'frames/s': frames / elapsed,
+            'KB/s': frame_bytes / elapsed / 1024,
+            'resp/s': responses / elapsed,
+            'burst p50 ms': latencies[len(latencies) // 2] * 1000,
+            'burst p99 ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+            'throttled': sum(c.received['throttled_callback'] for c in bench_clients)}
+
+
+def bench_payload(mode: str, clients: int, rounds: int, interval: float) -> dict:
+    """
+    :return: the results of every PAYLOAD_VARIANTS against a {mode} server, by variant
+    """
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'players.csv')
+        for variant, (env, batches) in PAYLOAD_VARIANTS.items():
+            write_players(csv_path, [f'player{i}' for i in range(clients)])
+            server, _ = start_server(mode, csv_path, env)
+            try:
+                report[f'{mode} {variant}'] = asyncio.run(run_payload(URL, clients, rounds, interval, batches))
+            finally:
+                stop_server(server)
+    return report
+
+
+def print_savings(report: dict[str, dict]) -> None:
+    for mode in SERVERS:
+        if f'{mode} plain' not in report:
+            continue
+        plain, batched = report[f'{mode} plain'], report[f'{mode} batched']
+        print(f"{mode}: {1 - batched['bytes/resp'] / plain['bytes/resp']:.0%} fewer bytes, "
+              f"{1 - batched['frames/resp'] / plain['frames/resp']:.0%} fewer frames per response")
+
+
+#########################
+### ANSWER THROUGHPUT ###
+#########################
+
+async def run_answers(url: str, clients: int, rounds: int, interval: float) -> dict:
+    bench_clients = [BenchClient(CALLBACKS) for _ in range(clients)]
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    await asyncio.gather(*[c.connect(url, semaphore) for c in bench_clients])
+    await asyncio.gather(*[c.login(f'player{i}') for i, c in enumerate(bench_clients)])
+
+    async def play(client: BenchClient) -> list[float]:
+        latencies = []
+        for _ in range(rounds):
+            await client.request('play_question')
+            if client.last_event != 'play_question_callback':
+                continue
+            question = json.loads(client.last_data)
+            fields = {'question_id': question['qid'], 'answer': random.choice(question['answers'])}
+            latencies.append(await client.request('answer', helpers.build_json_msg('ans', 'client', fields)))
+            await asyncio.sleep(interval)
+        return latencies
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[play(c) for c in bench_clients])
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*[c.sio.disconnect() for c in bench_clients])
+
+    latencies = sorted(latency for result in results for latency in result)
+    return {'answers/s': sum(c.received['answer_callback'] for c in bench_clients) / elapsed,
+            'answer p50 ms': latencies[len(latencies) // 2] * 1000,
+            'answer p99 ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+            'throttled': sum(c.received['throttled_callback'] for c in bench_clients)}
+
+
+def bench_answers(mode: str, clients: int, rounds: int, interval: float, players: int) -> dict:
+    """
+    :return: the results of every ANSWER_VARIANTS against a {mode} server, by variant
+    """
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'players.csv')
+        for variant, env in ANSWER_VARIANTS.items():
+            write_players(csv_path, [f'player{i}' for i in range(max(players, clients))])
+            server, _ = start_server(mode, csv_path, env)
+            try:
+                report[f'{mode} {variant}'] = asyncio.run(run_answers(URL, clients, rounds, interval))
+            finally:
+                stop_server(server)
+    return report
+
+
+def print_answer_gains(report: dict[str, dict]) -> None:
+    for mode in SERVERS:
+        if f'{mode} save every flush' not in report:
+            continue
+        every_flush, interval = report[f'{mode} save every flush'], report[f'{mode} save interval']
+        print(f"{mode}: {interval['answers/s'] / every_flush['answers/s'] - 1:+.0%} answers/s saving "
+              f"every {score_buffer.SAVE_INTERVAL:g}s than every {score_buffer.FLUSH_INTERVAL:g}s")
+
+
+####################
+### MEMORY USAGE ###
+####################
+
+def memory_usage() -> tuple[int, int]:
+    """
+    :return: the resident and the private (not shared) memory of this process, in bytes
+    """
+    with open('/proc/self/statm') as statm:
+        _, resident, shared = (int(field) for field in statm.read().split()[:3])
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    return resident * page_size, (resident - shared) * page_size
+
+
+def generate_questions(n: int, path: str) -> None:
+    """
+    writes {n} random questions in the opentdb json shape, one per line
+    """
+    words = [''.join(random.choices('abcdefghijklmnopqrstuvwxyz', k=random.randint(3, 10))) for _ in range(20000)]
+    categories = [f'Category {i}' for i in range(24)]
+    with open(path, 'w') as questions_file:
+        for _ in range(n):
+            answers = [' '.join(random.choices(words, k=random.randint(1, 3))) for _ in range(4)]
+            questions_file.write(json.dumps({'category': random.choice(categories),
+                                             'question': ' '.join(random.choices(words, k=random.randint(6, 16))) + '?',
+                                             'correct_answer': answers[0], 'incorrect_answers': answers[1:]}) + '\n')
+
+
+def measure_bank(kind: str, questions_path: str, store_path: str, results) -> None:
+    """
+    loads the questions as a {kind} bank in a fresh process and reports its memory growth
+    """
+    import gc
+    import pandas as pd
+    import question_store
+
+    gc.collect()
+    resident, private = memory_usage()
+    if kind == 'mmap':
+        bank = question_store.QuestionStore.load(store_path)
+        for qid in range(len(bank)):  # touch every page
+            bank.get(qid)
+    else:
+        questions, answers, correct_answers = [], [], []
+        store = question_store.QuestionStore()
+        with open(questions_path) as questions_file:
+            for line in questions_file:
+                q = json.loads(line)
+                if kind == 'dataframe':
+                    questions.append(q['question'])
+                    answers.append([q['correct_answer'], *q['incorrect_answers']])
+                    correct_answers.append(q['correct_answer'])
+                else:
+                    store.add(q['question'], [q['correct_answer'], *q['incorrect_answers']], q['correct_answer'],
+                              q['category'])
+        if kind == 'dataframe':
+            bank = pd.DataFrame({'question': questions, 'answers': answers, 'correct_answer': correct_answers,
+                                 'id': range(1, len(questions) + 1)})
+        else:
+            bank = store
+            store.save(store_path)
+        del questions, answers, correct_answers
+    gc.collect()
+    end_resident, end_private = memory_usage()
+    results.put((end_resident - resident, end_private - private))
+
+
+def bench_memory(n: int) -> dict:
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        questions_path = os.path.join(tmp_dir, 'questions.jsonl')
+        store_path = os.path.join(tmp_dir, 'questions.bank')
+        generate_questions(n, questions_path)
+        for kind in ('dataframe', 'store', 'mmap'):
+            process = context.Process(target=measure_bank, args=(kind, questions_path, store_path, results))
+            process.start()
+            resident, private = results.get()
+            process.join()
+            report[kind] = {'rss MB/100k': resident / n * 100000 / 2 ** 20,
+                            'private MB/100k': private / n * 100000 / 2 ** 20}
+    return report
+
+
+def print_report(report: dict[str, dict]) -> None:
+    columns = list(next(iter(report.values())))
+    width = max(len(mode) for mode in report) + 2
+    print('mode'.ljust(width) + ''.join(column.rjust(max(12, len(column) + 2)) for column in columns))
+    for mode, results in report.items():
+        print(mode.ljust(width) + ''.join(f'{results[column]:{max(12, len(column) + 2)}.2f}' for column in columns))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='benchmark the trivia socket-io servers')
+    parser.add_argument('mode', nargs='?', choices=[*SERVERS, 'both', 'memory', 'payload', 'answers'], default='both')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--events', type=int, default=20,
+                        help='play_question events per client (bursts per client for the payload mode, '
+                             'questions answered per client for the answers mode)')
+    parser.add_argument('--interval', type=float, default=0, help='seconds between a client\'s events')
+    parser.add_argument('--flood', type=int, default=0, help='clients firing play_question without pause')
+    parser.add_argument('--max-p99', type=float, help='fail if a measured p99 latency (ms) exceeds it')
+    parser.add_argument('--startup-budget', type=float,
+                        help='fail if the time (ms) from launch to the first accepted connection exceeds it')
+    parser.add_argument('--questions', type=int, default=100000, help='questions for the memory mode')
+    parser.add_argument('--players', type=int, default=ANSWER_PLAYERS, help='players of the answers mode\'s league')
+    args = parser.parse_args()
+
+    if args.mode == 'memory':
+        print_report(bench_memory(args.questions))
+        return
+    if args.mode == 'payload':
+        report = {}
+        for mode in SERVERS:
+            report.update(bench_payload(mode, args.clients, args.events, args.interval))
+        print_report(report)
+        print_savings(report)
+        return
+    if args.mode == 'answers':
+        report = {}
+        for mode in SERVERS:
+            report.update(bench_answers(mode, args.clients, args.events, args.interval, args.players))
+        print_report(report)
+        print_answer_gains(report)
+        return
+
+    modes = list(SERVERS) if args.mode == 'both' else [args.mode]
+    report = {mode: bench_mode(mode, args.clients, args.events, args.flood, args.interval) for mode in modes}
+    print_report(report)
+    if args.max_p99 is not None and any(results['p99 ms'] > args.max_p99 for results in report.values()):
+        sys.exit(f'p99 latency is over the {args.max_p99} ms budget')
+    if args.startup_budget is not None and any(results['startup ms'] > args.startup_budget
+                                               for results in report.values()):
+        sys.exit(f'startup is over the {args.startup_budget} ms budget')
+
+
+if __name__ == '__main__':
+    main()
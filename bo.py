@@ -8,13 +8,14 @@ import time
 import sys
 
 import helpers
+import response_batcher
 
 ###############
 ### GLOBALS ###
 ###############
 
 sio = socketio.Client()
-sio.connect('http://127.0.0.1:8080')
+sio.connect('http://127.0.0.1:8080', auth=response_batcher.BATCH_AUTH)
 locker = threading.Event()
 is_connected = False
 TIMEOUT = 8
@@ -76,6 +77,15 @@ def login_callback(data: str) -> None:
     locker.set()
 
 
+@sio.on(response_batcher.BATCH_EVENT)
+def batch_callback(data) -> None:
+    # the server coalesces responses sent within one tick, and compresses large ones
+    for event, event_data in response_batcher.unpack(data):
+        handler = sio.handlers['/'].get(event)
+        if handler is not None:
+            handler(event_data)
+
+
 @sio.on('add_question_callback')
 def add_question_callback(data: str) -> None:
     data = json.loads(data)
@@ -97,6 +107,27 @@ def register_player_callback(data: str) -> None:
     locker.set()
 
 
+@sio.on('profile_callback')
+def profile_callback(data: str) -> None:
+    data = json.loads(data)
+    print(data['msg'])
+    locker.set()
+
+
+@sio.on('profile_report_callback')
+def profile_report_callback(data: str) -> None:
+    data = json.loads(data)
+    print(data['msg'])
+    print(f"The report was saved on the server to {data['path']}")
+
+
+@sio.on('analytics_callback')
+def analytics_callback(data: str) -> None:
+    data = json.loads(data)
+    print(data['msg'])
+    locker.set()
+
+
 @sio.on('error_callback')
 def error_callback(data: str) -> None:
     data = json.loads(data)
@@ -105,6 +136,20 @@ def error_callback(data: str) -> None:
     locker.set()
 
 
+@sio.on('throttled_callback')
+def throttled_callback(data: str) -> None:
+    data = json.loads(data)
+    print(data['msg'])
+    locker.set()
+
+
+@sio.on('warming_up_callback')
+def warming_up_callback(data: str) -> None:
+    data = json.loads(data)
+    print(data['msg'])
+    locker.set()
+
+
 ##########################
 ### Socket-IO Handlers ###
 ##########################
@@ -121,13 +166,14 @@ def disconnect() -> None:
 
 def login_handler() -> None:
     """
-    get m_name and password from the manager and login
+    get m_name, password and league from the manager and login
     :return: None
     """
     print("Hey Manager,")
     username = input('Please enter your name: ')
     password = input('Please enter password: ')
-    fields = {'username': username, 'password': password, 'user_type': USER_TYPE}
+    league = input('Please enter the league you manage (leave empty for the default league): ')
+    fields = {'username': username, 'password': password, 'user_type': USER_TYPE, 'league': league}
     data_to_send = helpers.build_json_msg('login', 'manager', fields)
     print('Logging in...')
     sio.emit(event='login', data=data_to_send)
@@ -135,7 +181,12 @@ def login_handler() -> None:
 
 def logout_handler() -> None:
     try:
-        sio.emit('logout_handler', data='')
+        sio.emit('logout')
+        # the server revokes the session's resume tokens, then disconnects the client.
+        # disconnecting first would drop the logout before the server handles it
+        deadline = time.monotonic() + TIMEOUT
+        while sio.connected and time.monotonic() < deadline:
+            sio.sleep(0.1)
     finally:
         disconnect()
         exit()
@@ -176,6 +227,18 @@ def register_player_handler() -> None:
     sio.emit(event='register_player', data=new_player_data)
 
 
+def profile_server_handler() -> None:
+    seconds = input('Profile the server for how many seconds? ')
+    while not seconds.isdigit():
+        print("Invalid choice")
+        seconds = input('Profile the server for how many seconds? ')
+    sio.emit(event='server_profile', data=json.dumps({'seconds': int(seconds)}))
+
+
+def analytics_handler() -> None:
+    sio.emit(event='server_analytics')
+
+
 def manager_menu(cmd=None) -> bool | None:
     """
     a menu for manager
@@ -185,8 +248,10 @@ def manager_menu(cmd=None) -> bool | None:
 1 - Add question
 2 - Get logged in users
 3 - Register new player
-4 - Log out\n"""
-    command = get_input_and_validate(['1', '2', '3', '4'], creator_menu_msg)
+4 - Profile the server
+5 - View question analytics
+6 - Log out\n"""
+    command = get_input_and_validate(['1', '2', '3', '4', '5', '6'], creator_menu_msg)
     match command:
         case '1':
             add_question_handler()
@@ -195,6 +260,10 @@ def manager_menu(cmd=None) -> bool | None:
         case '3':
             register_player_handler()
         case '4':
+            profile_server_handler()
+        case '5':
+            analytics_handler()
+        case '6':
             logout_handler()
             return True
         case _:
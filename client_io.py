@@ -8,17 +8,19 @@ from functools import reduce
 import socketio
 import chatlib
 import helpers
+import response_batcher
 
 ###############
 ### GLOBALS ###
 ###############
 
 is_connected = False
+resume_token = None  # lets the client resume its session after its connection drops
 TIMEOUT = 18
 PROTOCOL_TYPE = 'client'
 USER_TYPE = '1'
 sio = socketio.Client()
-sio.connect('http://127.0.0.1:8080')
+sio.connect('http://127.0.0.1:8080', auth=response_batcher.BATCH_AUTH)
 locker = threading.Event()
 
 
@@ -66,17 +68,47 @@ def get_input_and_validate(input_choices: list[str], menu_msg: str) -> str:
 ### Socket-IO Callbacks ###
 ###########################
 
+@sio.event
+def connect() -> None:
+    # socket-io reconnected after a drop, resume the session instead of logging in again
+    if resume_token is not None:
+        sio.emit(event='resume', data=json.dumps({'resume_token': resume_token}))
+
+
 @sio.on('login_callback')
 def login_callback(data: str) -> None:
-    global is_connected
+    global is_connected, resume_token
     data = json.loads(data)
     if data['result'] == 'ACK':
         is_connected = True
+        resume_token = data['resume_token']
     else:
         print(data['msg'], 'Please try again.')
     locker.set()
 
 
+@sio.on(response_batcher.BATCH_EVENT)
+def batch_callback(data) -> None:
+    # the server coalesces responses sent within one tick, and compresses large ones
+    for event, event_data in response_batcher.unpack(data):
+        handler = sio.handlers['/'].get(event)
+        if handler is not None:
+            handler(event_data)
+
+
+@sio.on('resume_callback')
+def resume_callback(data: str) -> None:
+    global is_connected, resume_token
+    data = json.loads(data)
+    print(data['msg'])
+    if data['result'] == 'ACK':
+        resume_token = data['resume_token']
+    else:
+        is_connected = False
+        resume_token = None
+    locker.set()
+
+
 @sio.on('play_question_callback')
 def play_question_callback(data: str) -> None:
     question_data = json.loads(data)
@@ -120,6 +152,20 @@ def error_callback(data: str) -> None:
     locker.set()
 
 
+@sio.on('throttled_callback')
+def throttled_callback(data: str) -> None:
+    data = json.loads(data)
+    print(data['msg'])
+    locker.set()
+
+
+@sio.on('warming_up_callback')
+def warming_up_callback(data: str) -> None:
+    data = json.loads(data)
+    print(data['msg'])
+    locker.set()
+
+
 ##########################
 ### Socket-IO Handlers ###
 ##########################
@@ -136,12 +182,13 @@ def disconnect() -> None:
 
 def login_handler() -> None:
     """
-    get username and password from the user and login
+    get username, password and league from the user and login
     :return: None
     """
     username = input('Please enter username: ')
     password = input('Please enter password: ')
-    fields = {'username': username, 'password': password, 'user_type': USER_TYPE}
+    league = input('Please enter your league (leave empty for the default league): ')
+    fields = {'username': username, 'password': password, 'user_type': USER_TYPE, 'league': league}
     data = helpers.build_json_msg('login', PROTOCOL_TYPE, fields)
     print('Logging in...')
     sio.emit(event='login', data=data)
@@ -149,7 +196,12 @@ def login_handler() -> None:
 
 def logout_handler() -> None:
     try:
-        sio.emit('logout_handler')
+        sio.emit('logout')
+        # the server revokes the session's resume tokens, then disconnects the client.
+        # disconnecting first would drop the logout before the server handles it
+        deadline = time.monotonic() + TIMEOUT
+        while sio.connected and time.monotonic() < deadline:
+            sio.sleep(0.1)
     finally:
         disconnect()
         exit()
@@ -224,15 +276,15 @@ def player_menu(cmd=None):
 def main() -> None:
     global is_connected
 
-    # step 1: log in
-    while not is_connected:
-        login_handler()
-        time.sleep(0.1)
-        locker.wait()
-        locker.clear()
-
-    # step 2: main menu
     while True:
+        # step 1: log in, again if the session couldn't be resumed after a drop
+        while not is_connected:
+            login_handler()
+            time.sleep(0.1)
+            locker.wait()
+            locker.clear()
+
+        # step 2: main menu
         if player_menu():
             break
         time.sleep(0.1)
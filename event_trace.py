@@ -0,0 +1,104 @@
+import json
+import os
+import time
+
+###############
+### GLOBALS ###
+###############
+
+TRACE_ENV = 'TRIVIA_TRACE'  # set to a file path to record the server's inbound events
+TRACE_VERSION = 1
+REDACTED = '***'
+REDACTED_FIELDS = ('password', 'resume_token')
+
+
+def redact_fields(fields: dict) -> dict:
+    """
+    :return: a copy of {fields} with its credentials replaced by REDACTED
+    """
+    return {key: REDACTED if key in REDACTED_FIELDS else value for key, value in fields.items()}
+
+
+def redact(data):
+    """
+    :return: the event's data (a json string or a dict) with its credentials replaced by REDACTED
+    """
+    if isinstance(data, dict):
+        return redact_fields(data)
+    if not isinstance(data, str) or not any(field in data for field in REDACTED_FIELDS):
+        return data
+    try:
+        fields = json.loads(data)
+    except ValueError:
+        return data
+    if not isinstance(fields, dict):
+        return data
+    return json.dumps(redact_fields(fields))
+
+
+class TraceRecorder:
+    """
+    appends every inbound socket-io event to a trace file, one compact json line per event:
+    {"t": seconds since the recording started, "s": sid number, "e": event, "n": payload size, "d": payload}.
+    the first line is a header with the wall-clock start time. sids are numbered in order of appearance
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, 'a', buffering=1, encoding='utf-8')  # line buffered, survives a kill
+        self.start = time.monotonic()
+        self.sids = {}
+        self.sid_count = 0
+        self.write({'v': TRACE_VERSION, 'start': time.time()})
+
+    @classmethod
+    def from_env(cls):
+        """
+        :return: a recorder writing to the file named by TRACE_ENV, or None if recording is off
+        """
+        path = os.environ.get(TRACE_ENV)
+        return cls(path) if path else None
+
+    def write(self, entry: dict) -> None:
+        self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+    def record(self, sid, event: str, data=None) -> None:
+        sid_number = self.sids.get(sid)
+        if sid_number is None:
+            sid_number = self.sids[sid] = self.sid_count
+            self.sid_count += 1
+        entry = {'t': round(time.monotonic() - self.start, 6), 's': sid_number, 'e': event,
+                 'n': len(data) if isinstance(data, str) else 0}
+        if data is not None:
+            entry['d'] = redact(data)
+        self.write(entry)
+        if event == 'disconnect':
+            del self.sids[sid]
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_trace(path: str) -> tuple[dict, list[dict]]:
+    """
+    reads a trace file. when several recordings were appended to the same file,
+    their times are shifted onto the first one's clock and their sids renumbered apart
+    :return: the first header, and the event records ordered by time
+    """
+    first_header, records = None, []
+    time_offset = sid_offset = next_sid_offset = 0
+    with open(path, encoding='utf-8') as trace_file:
+        for line in trace_file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if 'v' in entry:
+                first_header = first_header or entry
+                time_offset = entry['start'] - first_header['start']
+                sid_offset = next_sid_offset
+                continue
+            entry['t'] += time_offset
+            entry['s'] += sid_offset
+            next_sid_offset = max(next_sid_offset, entry['s'] + 1)
+            records.append(entry)
+    records.sort(key=lambda record: record['t'])
+    return first_header, records
@@ -0,0 +1,210 @@
+"""
+Merges offline question dumps in opentdb shape into a questions store file (see question_store.py).
+Rows are parsed, unescaped, normalized, validated and signed for duplicate detection in a process pool,
+then the new, non-duplicate ones are appended to the store, which is replaced atomically,
+so running servers pick up the new version without a restart.
+
+a dump is a .json file (an opentdb response {"results": [...]}, or a list of questions),
+a .jsonl file (a question per line), or a .csv file with the columns
+category, question, correct_answer and incorrect_answers (a json list, or answers separated by '|').
+
+usage: python ingest_questions.py BANK DUMP [DUMP ...] [--workers N] [--chunk-size N]
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import helpers
+import question_index
+import question_store
+
+###############
+### GLOBALS ###
+###############
+
+CHUNK_SIZE = 2000  # rows per task sent to a worker process
+INCORRECT_ANSWERS = question_store.ANSWERS_PER_QUESTION - 1
+MAX_INVALID_REPORTED = 10
+
+_index = None  # the worker process' question_index.QuestionIndex, only used to prepare questions
+
+
+###############
+### READERS ###
+###############
+
+def read_json(path: str):
+    with open(path, encoding='utf-8') as dump:
+        data = json.load(dump)
+    yield from data['results'] if isinstance(data, dict) else data
+
+
+def read_jsonl(path: str):
+    with open(path, encoding='utf-8') as dump:
+        for line in dump:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_csv(path: str):
+    with open(path, encoding='utf-8', newline='') as dump:
+        for row in csv.DictReader(dump):
+            incorrect_answers = row.get('incorrect_answers') or ''
+            if incorrect_answers.startswith('['):
+                row['incorrect_answers'] = json.loads(incorrect_answers)
+            else:
+                row['incorrect_answers'] = incorrect_answers.split('|')
+            yield row
+
+
+READERS = {'.json': read_json, '.jsonl': read_jsonl, '.csv': read_csv}
+
+
+def read_rows(paths: list[str]):
+    """
+    yields the raw questions of all the dumps, in order
+    """
+    for path in paths:
+        yield from READERS[os.path.splitext(path)[1].lower()](path)
+
+
+def chunks(rows, size: int):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def ordered_map(pool: ProcessPoolExecutor, func, tasks, window: int):
+    """
+    pool.map that keeps at most {window} tasks in flight, so huge dumps aren't read into memory at once
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(func, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+###############
+### WORKERS ###
+###############
+
+def init_worker() -> None:
+    global _index
+    _index = question_index.QuestionIndex()
+
+
+def parse_row(row) -> tuple:
+    """
+    unescapes and validates a raw question
+    :return: (question, answers, correct answer, category)
+    :raises ValueError: if the row isn't a valid question
+    """
+    if not isinstance(row, dict):
+        raise ValueError('not a question object')
+    question, correct_answer = row.get('question'), row.get('correct_answer')
+    incorrect_answers, category = row.get('incorrect_answers'), row.get('category') or ''
+    if not isinstance(question, str) or not isinstance(correct_answer, str) or not isinstance(category, str):
+        raise ValueError('question, correct_answer and category must be strings')
+    if not isinstance(incorrect_answers, list) or not all(isinstance(answer, str) for answer in incorrect_answers):
+        raise ValueError('incorrect_answers must be a list of strings')
+
+    question = helpers.parse_notation(question).strip()
+    correct_answer = helpers.parse_notation(correct_answer).strip()
+    incorrect_answers = [helpers.parse_notation(answer).strip() for answer in incorrect_answers]
+    if not question or not correct_answer or not all(incorrect_answers):
+        raise ValueError('empty question or answer')
+    if len(set(incorrect_answers)) != INCORRECT_ANSWERS or correct_answer in incorrect_answers:
+        raise ValueError(f'a question needs {INCORRECT_ANSWERS} distinct incorrect answers')
+    answers = helpers.gather_answers(correct_answer, incorrect_answers)
+    return question, answers, correct_answer, helpers.parse_notation(category).strip()
+
+
+def prepare_rows(rows: list) -> tuple[list, list]:
+    """
+    :return: the valid rows as (parsed row, prepared question), and the errors of the invalid ones
+    """
+    prepared, errors = [], []
+    for row in rows:
+        try:
+            parsed = parse_row(row)
+        except ValueError as e:
+            errors.append(f'{e}: {str(row)[:80]}')
+            continue
+        prepared.append((parsed, _index.prepare(parsed[0])))
+    return prepared, errors
+
+
+def prepare_questions(questions: list[str]) -> list:
+    return [_index.prepare(question) for question in questions]
+
+
+##############
+### INGEST ###
+##############
+
+def ingest(bank_path: str, dump_paths: list[str], workers: int | None = None, chunk_size: int = CHUNK_SIZE) -> dict:
+    """
+    merges the dumps into the store file at {bank_path}, creating it if needed
+    :return: counts of the rows read, added, duplicated and invalid
+    """
+    if os.path.exists(bank_path):
+        store = question_store.QuestionStore.load(bank_path)
+        store.copy_to_memory()
+    else:
+        store = question_store.QuestionStore()
+    index = question_index.QuestionIndex()
+    counts = {'bank': len(store), 'rows': 0, 'added': 0, 'duplicates': 0, 'invalid': 0}
+    workers = workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        # index the bank's questions, then merge the dumps in order, so the first of duplicates is kept
+        existing = chunks((question for _, question in store.questions()), chunk_size)
+        prepared_bank = ordered_map(pool, prepare_questions, existing, 2 * workers)
+        for qid, prepared in enumerate(q for chunk in prepared_bank for q in chunk):
+            index.add_prepared_if_new(prepared, qid)
+
+        dump_chunks = chunks(read_rows(dump_paths), chunk_size)
+        for valid, errors in ordered_map(pool, prepare_rows, dump_chunks, 2 * workers):
+            counts['rows'] += len(valid) + len(errors)
+            for error in errors:
+                if counts['invalid'] < MAX_INVALID_REPORTED:
+                    print('[INGEST] invalid row>> ', error)
+                counts['invalid'] += 1
+            for (question, answers, correct_answer, category), prepared in valid:
+                if not index.add_prepared_if_new(prepared, len(store)):
+                    counts['duplicates'] += 1
+                    continue
+                store.add(question, answers, correct_answer, category)
+                counts['added'] += 1
+
+    if counts['added']:
+        store.save(bank_path)
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='merge offline question dumps into a questions store file')
+    parser.add_argument('bank', help='the questions store file, created if it doesn\'t exist')
+    parser.add_argument('dumps', nargs='+', help='.json, .jsonl or .csv dumps in opentdb shape')
+    parser.add_argument('--workers', type=int, help='worker processes, defaults to the number of cpus')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='rows per worker task')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = ingest(args.bank, args.dumps, args.workers, args.chunk_size)
+    elapsed = time.perf_counter() - start
+    print(f"read {counts['rows']} rows in {elapsed:.2f}s ({counts['rows'] / elapsed:.0f} rows/s): "
+          f"{counts['added']} added, {counts['duplicates']} duplicates, {counts['invalid']} invalid")
+    print(f"{args.bank} now holds {counts['bank'] + counts['added']} questions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+import glob
+import logging
+import os
+import re
+import threading
+
+import helpers
+import question_stats
+import score_buffer
+
+###############
+### GLOBALS ###
+###############
+
+DEFAULT_LEAGUE = 'default'
+LEAGUE_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+BANK_CHECK_INTERVAL = 5  # seconds between checks for a new version of the questions store files
+WEB_TIMEOUT = 10  # seconds to wait for the questions api
+
+
+def bank_version(path: str) -> tuple | None:
+    """
+    :return: an id of the current version of a questions store file, None if there is no such file.
+    store files are replaced atomically on save, so a new version is a new inode
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def index_questions(store):
+    """
+    :return: a question_index.QuestionIndex over all the questions of {store} (or of a question bank)
+    """
+    import question_index
+
+    index = question_index.QuestionIndex()
+    for qid, question in store.questions():
+        index.add(question, qid)
+    return index
+
+
+def league_file(path: str, name: str) -> str:
+    """
+    :return: the league's version of a file: players.csv -> players.<name>.csv, the default league keeps {path}
+    """
+    if name == DEFAULT_LEAGUE:
+        return path
+    stem, ext = os.path.splitext(path)
+    return f'{stem}.{name}{ext}'
+
+
+def discover_leagues(players_path: str) -> list[str]:
+    """
+    a league is a players csv file next to the default league's one, named players.<league>.csv
+    :return: the names of the leagues, the default league first
+    """
+    stem, ext = os.path.splitext(players_path)
+    names = [DEFAULT_LEAGUE]
+    for path in sorted(glob.glob(f'{glob.escape(stem)}.*{ext}')):
+        name = path[len(stem) + 1:len(path) - len(ext)]
+        if LEAGUE_NAME.match(name) and name != DEFAULT_LEAGUE:
+            names.append(name)
+    return names
+
+
+class League:
+    """
+    the state of a single league (tenant): its players, its questions bank and their indexes.
+    leagues never share state, so their leaderboards, presence lists and question decks
+    are sized by their own players and questions
+    """
+
+    def __init__(self, name: str, players_path: str, questions_path: str | None):
+        self.name = name
+        self.players_path = players_path
+        self.questions_path = questions_path  # question_store file, None to use the web
+        self.questions_bank = None  # question_store.QuestionBank
+        self.questions_index = None  # question_index.QuestionIndex over {questions_bank}, for duplicate checks
+        self.bank_version = None  # bank_version() of the mapped questions store file
+        self.players = None
+        self.player_index = {}  # player id -> players index
+        # player id -> (question id, time.monotonic() it was asked) of the question it hasn't answered yet
+        self.pending_questions = {}
+        # player id -> generation of its valid resume tokens, bumped on logout. kept in memory only,
+        # so a restart revives the tokens revoked before it until they expire (resume_token.TOKEN_TTL)
+        self.token_generations = {}
+        self.scores = score_buffer.ScoreBuffer()
+        self.answer_stats = question_stats.QuestionStats()
+        self.loaded = False
+        self.csv_lock = threading.Lock()  # serializes the writes of the players csv file
+        self.closed = False  # set by the final write on shutdown, so stale snapshots aren't written after it
+
+    ####################
+    ### DATA LOADERS ###
+    ####################
+
+    def init_state(self) -> None:
+        """
+        builds the initial questions bank and an empty players data frame.
+        the questions bank's stored questions are memory-mapped from the questions store file when one exists
+        """
+        import pandas as pd
+        import question_store
+
+        if self.questions_path is not None and os.path.exists(self.questions_path):
+            self.swap_bank(*self.read_bank())
+        else:
+            self.questions_bank = question_store.QuestionBank()
+            self.questions_bank.add('Which Basketball team has completed two threepeats?',
+                                    ['Chicago Bulls', 'LA Lakers', 'Golden state Warriors', 'Boston Celtics'],
+                                    'Chicago Bulls')
+            self.questions_index = index_questions(self.questions_bank)
+
+        players = pd.DataFrame({'username': [],
+                                'password': [],
+                                'score': [],
+                                'is_manager': [],
+                                'id': [],
+                                'sid': [],
+                                'games_played': [],
+                                'wins_in_row': []})
+        players['is_manager'] = players['is_manager'].astype(bool)
+        players['score'] = players['score'].astype(int)
+        players['games_played'] = players['games_played'].astype(int)
+        players['wins_in_row'] = players['wins_in_row'].astype(int)
+        self.players = players
+
+    def load(self) -> None:
+        self.init_state()
+        # a prepared questions store is served as is, so the processes mapping it keep sharing it
+        if self.questions_path is None or not os.path.exists(self.questions_path):
+            self.update_questions_bank_from_web()
+        self.read_and_append_csv()
+        self.loaded = True
+
+    def bank_changed(self) -> bool:
+        """
+        :return: True if the questions store file has a version the league hasn't loaded yet
+        """
+        if self.questions_path is None:
+            return False
+        version = bank_version(self.questions_path)
+        return version is not None and version != self.bank_version
+
+    def read_bank(self) -> tuple:
+        """
+        maps the questions store file and indexes it. blocking, so servers run it in the background
+        :return: the store, an index of its questions and its file version, for swap_bank
+        """
+        import question_store
+
+        version = bank_version(self.questions_path)
+        store = question_store.QuestionStore.load(self.questions_path)
+        return store, index_questions(store), version
+
+    def swap_bank(self, store, index, version) -> None:
+        """
+        replaces the stored questions of the bank with a version read by read_bank.
+        the runtime questions are kept with their ids, and added to the new index
+        """
+        import question_store
+
+        if self.questions_bank is None:
+            bank = question_store.QuestionBank(store)
+        else:
+            bank = self.questions_bank.with_stored(store)
+        for qid, question in bank.runtime_questions():
+            index.add(question, qid)
+        self.questions_bank, self.questions_index, self.bank_version = bank, index, version
+        logging.info(msg=f'{self.name}: mapped {len(store)} questions from {self.questions_path}')
+
+    def update_questions_bank_from_web(self) -> None:
+        import requests
+
+        response = requests.get(url="https://opentdb.com/api.php?amount=50&type=multiple", timeout=WEB_TIMEOUT)
+        if not response.ok:
+            logging.info(msg=f'GET request failed. Status code: {response.status_code}')
+            return
+        payload = response.json()['results']
+
+        for q in payload:
+            question = helpers.parse_notation(q['question'])
+            # skip duplicates of the bank's questions, and of the ones earlier in this payload
+            if not self.questions_index.add_if_new(question, self.questions_bank.next_qid()):
+                continue
+
+            correct_answer = q['correct_answer']
+            incorrect_answers = q['incorrect_answers']
+
+            # add the question with a list of all its answers
+            self.questions_bank.add(question, helpers.gather_answers(correct_answer, incorrect_answers),
+                                    correct_answer, q.get('category', ''))
+        logging.info(msg=f'{self.name}: successfully updated questions from web')
+
+    def write_to_csv(self, frame=None, final: bool = False) -> None:
+        """
+        writes the players to a temporary file and replaces the csv file with it,
+        so a crash mid-write never leaves a truncated csv file
+        :param frame: a snapshot of the players data frame to write, defaults to {players} itself
+        :param final: True for the last write on shutdown, the snapshots still in flight are dropped
+        """
+        # never overwrite the csv file with players that haven't been loaded yet
+        if not self.loaded:
+            return
+        with self.csv_lock:
+            if self.closed:
+                return
+            self.closed = final
+            temp_path = f'{self.players_path}.tmp'
+            (self.players if frame is None else frame).to_csv(temp_path, index=False, mode='w')
+            os.replace(temp_path, self.players_path)
+
+    def flush_scores(self) -> None:
+        """
+        applies the buffered score changes to the players data frame
+        """
+        if self.loaded:
+            self.scores.apply(self.players)
+
+    def take_unsaved(self) -> bool:
+        """
+        :return: True if the players data frame has changes not yet written to the csv file
+        """
+        return self.loaded and self.scores.take_unsaved()
+
+    def read_and_append_csv(self) -> None:
+        """
+        reading a csv file and append the data to players data frame
+        """
+        import pandas as pd
+
+        temp_csv = pd.read_csv(self.players_path)
+        max_id = self.players.id.max()
+        for index, row in temp_csv.iterrows():
+            if row.id <= max_id:
+                continue
+            next_row = row
+            next_row['sid'] = None
+            self.players = self.players._append(row)
+        self.player_index.update({int(player_id): index for index, player_id in self.players['id'].items()})
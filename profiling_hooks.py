@@ -0,0 +1,91 @@
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+from collections import defaultdict
+
+###############
+### GLOBALS ###
+###############
+
+PROFILE_DIR = 'profiles'
+MAX_PROFILE_SECONDS = 300
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 15
+
+
+class ProfileSession:
+    """
+    an on-demand profiling session: cProfile over the serving thread, per-handler timings
+    and a tracemalloc snapshot diff. while inactive the servers only check {active}
+    """
+
+    def __init__(self):
+        self.active = False
+        self.profile = None
+        self.snapshot = None
+        self.started_tracemalloc = False
+        self.started_at = 0.0
+        self.handler_times = defaultdict(list)
+
+    def start(self) -> bool:
+        """
+        :return: True if the session started, False if one is already running
+        """
+        if self.active:
+            return False
+        self.handler_times = defaultdict(list)
+        self.started_tracemalloc = not tracemalloc.is_tracing()
+        if self.started_tracemalloc:
+            tracemalloc.start()
+        self.snapshot = tracemalloc.take_snapshot()
+        self.profile = cProfile.Profile()
+        self.started_at = time.perf_counter()
+        self.profile.enable()
+        self.active = True
+        return True
+
+    def time_handler(self, event: str, handler, sid, data):
+        """
+        calls a handler, recording how long it took
+        """
+        start = time.perf_counter()
+        try:
+            return handler(sid, data)
+        finally:
+            self.handler_times[event].append(time.perf_counter() - start)
+
+    def stop(self) -> tuple[str, str]:
+        """
+        stops the session and writes its report to PROFILE_DIR
+        :return: the report's path and text
+        """
+        self.profile.disable()
+        self.active = False
+        duration = time.perf_counter() - self.started_at
+        memory_diff = tracemalloc.take_snapshot().compare_to(self.snapshot, 'lineno')
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+
+        report = io.StringIO()
+        report.write(f'profiled {duration:.1f} seconds\n\n')
+        report.write(f'{"handler":24}{"calls":>8}{"total ms":>12}{"mean ms":>10}{"max ms":>10}\n')
+        for event, times in sorted(self.handler_times.items(), key=lambda item: -sum(item[1])):
+            report.write(f'{event:24}{len(times):8}{sum(times) * 1000:12.2f}'
+                         f'{sum(times) / len(times) * 1000:10.3f}{max(times) * 1000:10.3f}\n')
+
+        report.write('\n')
+        pstats.Stats(self.profile, stream=report).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+
+        report.write(f'top {TOP_ALLOCATIONS} memory growth by line\n')
+        for stat in memory_diff[:TOP_ALLOCATIONS]:
+            report.write(f'{stat}\n')
+        self.profile = self.snapshot = None
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, time.strftime('profile-%Y%m%d-%H%M%S.txt'))
+        with open(path, 'w') as report_file:
+            report_file.write(report.getvalue())
+        return path, report.getvalue()
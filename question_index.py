@@ -0,0 +1,139 @@
+import html
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+
+###############
+### GLOBALS ###
+###############
+
+NUM_PERMUTATIONS = 32
+BANDS = 8  # NUM_PERMUTATIONS / BANDS signature rows hashed together per LSH band
+SHINGLE_SIZE = 4  # characters per shingle
+SIMILARITY_THRESHOLD = 0.85  # estimated jaccard similarity from which two questions are duplicates
+MERSENNE_PRIME = (1 << 31) - 1
+INITIAL_CAPACITY = 1024
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+_NUMBERS = re.compile(r'\d+')
+
+
+def normalize_question(question: str) -> str:
+    """
+    normalizes a question for duplicate detection: fully unescapes html entities
+    (twice, for double-escaped api results), folds unicode forms and case,
+    and replaces punctuation with a space, so it never joins tokens ("2+2" isn't "22")
+    """
+    question = html.unescape(html.unescape(question))
+    question = unicodedata.normalize('NFKC', question).casefold()
+    question = _PUNCTUATION.sub(' ', question)
+    return _WHITESPACE.sub(' ', question).strip()
+
+
+def shingles(normalized: str) -> np.ndarray:
+    """
+    :return: the crc32 hashes of the question's overlapping character shingles
+    """
+    if len(normalized) <= SHINGLE_SIZE:
+        return np.array([zlib.crc32(normalized.encode())], dtype=np.uint64)
+    grams = {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(gram.encode()) for gram in grams), dtype=np.uint64, count=len(grams))
+
+
+def numbers_key(normalized: str) -> int:
+    """
+    :return: a hash of the numbers in the question, in order. near-duplicates must have the same numbers,
+    since "Which year did WW1 end" and "Which year did WW2 end" share most of their shingles
+    """
+    return zlib.crc32(' '.join(_NUMBERS.findall(normalized)).encode())
+
+
+class QuestionIndex:
+    """
+    duplicate detection over the questions bank.
+    exact duplicates (after normalization) are found in a hash set, and near-duplicates through
+    MinHash signatures bucketed by LSH bands, so a lookup only compares against the few questions
+    sharing a band instead of scanning the whole bank
+    """
+
+    def __init__(self, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, MERSENNE_PRIME, NUM_PERMUTATIONS, dtype=np.uint64)[:, None]
+        self.b = rng.integers(0, MERSENNE_PRIME, NUM_PERMUTATIONS, dtype=np.uint64)[:, None]
+        self.exact = {}  # normalized question -> question id
+        self.bands = [{} for _ in range(BANDS)]  # band bytes -> slots
+        self.signatures = np.empty((INITIAL_CAPACITY, NUM_PERMUTATIONS), dtype=np.uint32)
+        self.numbers = np.empty(INITIAL_CAPACITY, dtype=np.uint32)
+        self.ids = []  # slot -> question id
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def signature(self, normalized: str) -> np.ndarray:
+        hashes = (self.a * shingles(normalized)[None, :] + self.b) % MERSENNE_PRIME
+        return hashes.min(axis=1).astype(np.uint32)
+
+    @staticmethod
+    def band_keys(signature: np.ndarray) -> list[bytes]:
+        return [band.tobytes() for band in np.split(signature, BANDS)]
+
+    def _find(self, normalized: str, signature: np.ndarray, keys: list[bytes]):
+        if normalized in self.exact:
+            return self.exact[normalized]
+        candidates = {slot for band, key in zip(self.bands, keys) for slot in band.get(key, ())}
+        if not candidates:
+            return None
+        slots = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarity = np.count_nonzero(self.signatures[slots] == signature, axis=1) / NUM_PERMUTATIONS
+        similarity[self.numbers[slots] != numbers_key(normalized)] = 0
+        best = similarity.argmax()
+        return self.ids[slots[best]] if similarity[best] >= SIMILARITY_THRESHOLD else None
+
+    def find_duplicate(self, question: str):
+        """
+        :return: the id of an indexed question duplicating {question}, or None
+        """
+        return self._find(*self.prepare(question))
+
+    def add(self, question: str, qid) -> None:
+        self._add(*self.prepare(question), qid)
+
+    def _add(self, normalized: str, signature: np.ndarray, keys: list[bytes], qid) -> None:
+        slot = len(self.ids)
+        if slot == len(self.signatures):
+            self.signatures = np.resize(self.signatures, (2 * slot, NUM_PERMUTATIONS))
+            self.numbers = np.resize(self.numbers, 2 * slot)
+        self.signatures[slot] = signature
+        self.numbers[slot] = numbers_key(normalized)
+        self.ids.append(qid)
+        self.exact[normalized] = qid
+        for band, key in zip(self.bands, keys):
+            band.setdefault(key, []).append(slot)
+
+    def prepare(self, question: str) -> tuple:
+        """
+        :return: the normalized question, its signature and its band keys, for add_prepared_if_new.
+        indexes built with the same seed prepare questions alike, so this can run in other processes
+        """
+        normalized = normalize_question(question)
+        signature = self.signature(normalized)
+        return normalized, signature, self.band_keys(signature)
+
+    def add_if_new(self, question: str, qid) -> bool:
+        """
+        indexes {question} unless it duplicates an indexed question
+        :return: True if the question was added, o/w False
+        """
+        return self.add_prepared_if_new(self.prepare(question), qid)
+
+    def add_prepared_if_new(self, prepared: tuple, qid) -> bool:
+        """
+        add_if_new for a question already prepared with prepare()
+        """
+        if self._find(*prepared) is not None:
+            return False
+        self._add(*prepared, qid)
+        return True
@@ -0,0 +1,93 @@
+import bisect
+import time
+from collections import deque
+
+###############
+### GLOBALS ###
+###############
+
+HARDEST_COUNT = 20
+MIN_ANSWERS = 5  # answers a question needs before it's ranked by its correct rate
+ACTIVITY_HOURS = 24  # hours of active players kept
+
+
+class QuestionCounters:
+    __slots__ = ('answered', 'correct', 'timed', 'total_time')
+
+    def __init__(self):
+        self.answered = 0
+        self.correct = 0
+        self.timed = 0  # answers whose time from asking is known
+        self.total_time = 0.0
+
+    def correct_rate(self) -> float:
+        return self.correct / self.answered
+
+    def average_time(self) -> float | None:
+        return self.total_time / self.timed if self.timed else None
+
+
+class QuestionStats:
+    """
+    incremental aggregates over the answers, so the managers' queries never scan the game history:
+    per-question counters, the ranked questions kept sorted by correct rate (updated by bisection),
+    per-category counters and the players active in each of the last ACTIVITY_HOURS hours
+    """
+
+    def __init__(self):
+        self.questions = {}  # question id -> QuestionCounters
+        self.ranking = []  # sorted (correct rate, -answered, question id) of the questions with MIN_ANSWERS answers
+        self.categories = {}  # category -> [answered, correct]
+        self.hours = deque(maxlen=ACTIVITY_HOURS)  # (hour, ids of the players who answered in it), oldest first
+
+    def record_answer(self, qid: int, category: str, player_id: int, correct: bool,
+                      elapsed: float | None = None, now: float | None = None) -> None:
+        """
+        :param elapsed: seconds from asking the question to the answer, None if unknown
+        :param now: the time of the answer, defaults to the current time
+        """
+        counters = self.questions.get(qid)
+        if counters is None:
+            counters = self.questions[qid] = QuestionCounters()
+        elif counters.answered >= MIN_ANSWERS:
+            del self.ranking[bisect.bisect_left(self.ranking, self.rank_key(qid, counters))]
+        counters.answered += 1
+        counters.correct += correct
+        if elapsed is not None:
+            counters.timed += 1
+            counters.total_time += elapsed
+        if counters.answered >= MIN_ANSWERS:
+            bisect.insort(self.ranking, self.rank_key(qid, counters))
+
+        category_counters = self.categories.setdefault(category, [0, 0])
+        category_counters[0] += 1
+        category_counters[1] += correct
+
+        hour = int((time.time() if now is None else now) // 3600)
+        if not self.hours or self.hours[-1][0] != hour:
+            self.hours.append((hour, set()))
+        self.hours[-1][1].add(player_id)
+
+    @staticmethod
+    def rank_key(qid: int, counters: QuestionCounters) -> tuple:
+        # the most answered first among equally hard questions
+        return counters.correct_rate(), -counters.answered, qid
+
+    def hardest(self, count: int = HARDEST_COUNT) -> list[tuple[int, QuestionCounters]]:
+        """
+        :return: (question id, counters) of the {count} ranked questions with the lowest correct rate
+        """
+        return [(qid, self.questions[qid]) for _, _, qid in self.ranking[:count]]
+
+    def accuracy_by_category(self) -> dict[str, tuple[int, float]]:
+        """
+        :return: the answers and the correct rate of every category
+        """
+        return {category: (answered, correct / answered) for category, (answered, correct) in self.categories.items()}
+
+    def active_players(self, now: float | None = None) -> list[tuple[int, int]]:
+        """
+        :return: (hour, number of players who answered in it) of the last ACTIVITY_HOURS hours with answers
+        """
+        oldest = int((time.time() if now is None else now) // 3600) - ACTIVITY_HOURS + 1
+        return [(hour, len(player_ids)) for hour, player_ids in self.hours if hour >= oldest]
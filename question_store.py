@@ -0,0 +1,307 @@
+import mmap
+import os
+import struct
+from array import array
+
+###############
+### GLOBALS ###
+###############
+
+MAGIC = b'TRIVIAQS'
+FORMAT_VERSION = 1
+# magic, version, questions, strings, bytes of string data
+HEADER = struct.Struct('<8sIIQQ')
+ANSWERS_PER_QUESTION = 4
+ALIGNMENT = 8
+MIN_LOOKUP_SIZE = 1024
+RUNTIME_QID_OFFSET = 1 << 31  # ids of a QuestionBank's runtime questions start here, past any store file's
+
+
+class QuestionStore:
+    """
+    a columnar, memory-compact questions bank.
+    every distinct string (question, answer or category) is stored once, utf-8 encoded, in one contiguous
+    buffer addressed by an offsets array. a question is then a row of fixed-size ids:
+    its text, its ANSWERS_PER_QUESTION answers, its category and the index of its correct answer.
+    a question's id is its row number.
+
+    stores saved with save() can be opened with load(), memory-mapping the file read-only,
+    so several server processes share one copy of the bank. adding to a mapped store
+    first copies it to memory (copy-on-write)
+    """
+
+    def __init__(self):
+        self.strings = bytearray()
+        self.string_offsets = array('Q', [0])  # string i is strings[string_offsets[i]:string_offsets[i + 1]]
+        self.question_ids = array('I')
+        self.answer_ids = array('I')  # ANSWERS_PER_QUESTION per question
+        self.category_ids = array('I')
+        self.correct = bytearray()  # index of the correct answer, per question
+        # open-addressing hash table of string id + 1 (0 is an empty slot), built on the first add
+        self.string_lookup = None
+        self.mapped = None
+
+    def __len__(self) -> int:
+        return len(self.question_ids)
+
+    ###############
+    ### STRINGS ###
+    ###############
+
+    def string_bytes(self, string_id: int):
+        return self.strings[self.string_offsets[string_id]:self.string_offsets[string_id + 1]]
+
+    def string(self, string_id: int) -> str:
+        return str(self.string_bytes(string_id), 'utf-8')
+
+    def find_slot(self, data: bytes) -> int:
+        """
+        linear probing in the lookup table
+        :return: the slot holding {data}'s string id, or the empty slot where it belongs
+        """
+        mask = len(self.string_lookup) - 1
+        slot = hash(data) & mask
+        while self.string_lookup[slot] and self.string_bytes(self.string_lookup[slot] - 1) != data:
+            slot = (slot + 1) & mask
+        return slot
+
+    def build_lookup(self, n_strings: int) -> None:
+        """
+        (re)builds the lookup table with room for {n_strings} strings at half load
+        """
+        size = MIN_LOOKUP_SIZE
+        while size < 2 * n_strings:
+            size *= 2
+        self.string_lookup = array('I', bytes(size * 4))
+        for string_id in range(len(self.string_offsets) - 1):
+            self.string_lookup[self.find_slot(bytes(self.string_bytes(string_id)))] = string_id + 1
+
+    def intern(self, value: str) -> int:
+        """
+        :return: the id of {value} in the strings buffer, storing it if it isn't there yet
+        """
+        n_strings = len(self.string_offsets) - 1
+        if self.string_lookup is None or 2 * (n_strings + 1) > len(self.string_lookup):
+            self.build_lookup(2 * (n_strings + 1))
+
+        data = value.encode('utf-8')
+        slot = self.find_slot(data)
+        if self.string_lookup[slot]:
+            return self.string_lookup[slot] - 1
+        self.strings += data
+        self.string_offsets.append(len(self.strings))
+        self.string_lookup[slot] = n_strings + 1
+        return n_strings
+
+    #################
+    ### QUESTIONS ###
+    #################
+
+    def add(self, question: str, answers: list[str], correct_answer: str, category: str = '') -> int:
+        """
+        :return: the id of the added question
+        :raises ValueError: if there aren't ANSWERS_PER_QUESTION answers, or the correct answer isn't one of them
+        """
+        if len(answers) != ANSWERS_PER_QUESTION:
+            raise ValueError(f'a question must have {ANSWERS_PER_QUESTION} answers')
+        correct_index = answers.index(correct_answer)
+        if self.mapped is not None:
+            self.copy_to_memory()
+
+        self.question_ids.append(self.intern(question))
+        self.answer_ids.extend(self.intern(answer) for answer in answers)
+        self.category_ids.append(self.intern(category))
+        self.correct.append(correct_index)
+        return len(self.question_ids) - 1
+
+    def check_qid(self, qid: int) -> int:
+        """
+        :raises IndexError: if there is no question {qid}. the columns would wrap negative ids around
+        """
+        if not 0 <= qid < len(self):
+            raise IndexError(f'no question {qid}')
+        return qid
+
+    def question(self, qid: int) -> str:
+        return self.string(self.question_ids[self.check_qid(qid)])
+
+    def answers(self, qid: int) -> list[str]:
+        start = self.check_qid(qid) * ANSWERS_PER_QUESTION
+        return [self.string(string_id) for string_id in self.answer_ids[start:start + ANSWERS_PER_QUESTION]]
+
+    def correct_answer(self, qid: int) -> str:
+        return self.string(self.answer_ids[self.check_qid(qid) * ANSWERS_PER_QUESTION + self.correct[qid]])
+
+    def category(self, qid: int) -> str:
+        return self.string(self.category_ids[self.check_qid(qid)])
+
+    def is_correct(self, qid: int, answer: str) -> bool:
+        return self.correct_answer(qid) == answer
+
+    def get(self, qid: int) -> dict:
+        return {'qid': qid, 'question': self.question(qid), 'answers': self.answers(qid)}
+
+    def questions(self):
+        """
+        yields (question id, question text) of all the questions
+        """
+        for qid in range(len(self)):
+            yield qid, self.question(qid)
+
+    def nbytes(self) -> int:
+        """
+        :return: the size of the store's buffers
+        """
+        return sum(memoryview(column).nbytes for column in self.columns()) + len(self.strings)
+
+    def columns(self) -> tuple:
+        return self.string_offsets, self.question_ids, self.answer_ids, self.category_ids, self.correct
+
+    ###################
+    ### PERSISTENCE ###
+    ###################
+
+    def save(self, path: str) -> None:
+        """
+        writes the store to {path}, replacing it atomically, so processes that mapped
+        the previous version keep reading it until they load the new one
+        """
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as bank_file:
+            bank_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(self), len(self.string_offsets) - 1,
+                                        len(self.strings)))
+            for column in self.columns():
+                bank_file.write(memoryview(column).cast('B'))
+                bank_file.write(b'\0' * (-bank_file.tell() % ALIGNMENT))
+            bank_file.write(self.strings)
+            bank_file.flush()
+            os.fsync(bank_file.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'QuestionStore':
+        """
+        memory-maps a store saved with save(), read-only
+        :raises ValueError: if the file isn't a questions store, or its size doesn't match its header,
+        e.g. a file truncated or still being copied in place
+        """
+        store = cls()
+        with open(path, 'rb') as bank_file:
+            store.mapped = mmap.mmap(bank_file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(store.mapped)
+        if len(view) < HEADER.size:
+            raise ValueError(f'{path} is too short for a questions store')
+        magic, version, n_questions, n_strings, strings_size = HEADER.unpack_from(view)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a version {FORMAT_VERSION} questions store')
+
+        offset = HEADER.size
+        layout = []
+        for typecode, count in (('Q', n_strings + 1), ('I', n_questions),
+                                ('I', n_questions * ANSWERS_PER_QUESTION), ('I', n_questions), ('B', n_questions)):
+            size = count * array(typecode).itemsize
+            layout.append((typecode, offset, size))
+            offset += size + (-(offset + size) % ALIGNMENT)
+        if len(view) != offset + strings_size:
+            raise ValueError(f'{path} holds {len(view)} bytes, its header describes {offset + strings_size}')
+
+        columns = [view[start:start + size].cast(typecode) for typecode, start, size in layout]
+        store.string_offsets, store.question_ids, store.answer_ids, store.category_ids, store.correct = columns
+        store.strings = view[offset:offset + strings_size]
+        if store.string_offsets[0] != 0 or store.string_offsets[-1] != strings_size:
+            raise ValueError(f'{path} has string offsets out of its string data')
+        return store
+
+    def copy_to_memory(self) -> None:
+        """
+        copies a memory-mapped store to private, writable buffers
+        """
+        self.strings = bytearray(self.strings)
+        self.string_offsets, self.question_ids, self.answer_ids, self.category_ids = (
+            array(column.format, column) for column in self.columns()[:4])
+        self.correct = bytearray(self.correct)
+        self.mapped = None
+
+
+class QuestionBank:
+    """
+    a league's questions: the ones of its questions store file, with the file's ids,
+    and the ones added at runtime (the seed question, the web's and the managers'), kept in memory
+    with ids from RUNTIME_QID_OFFSET. store files are only ever appended to, and swapping in a new
+    version of the file leaves the runtime questions alone, so every id stays valid across hot reloads
+    """
+
+    def __init__(self, stored: QuestionStore | None = None, runtime: QuestionStore | None = None):
+        self.stored = QuestionStore() if stored is None else stored
+        self.runtime = QuestionStore() if runtime is None else runtime
+
+    def __len__(self) -> int:
+        return len(self.stored) + len(self.runtime)
+
+    def with_stored(self, stored: QuestionStore) -> 'QuestionBank':
+        """
+        :return: a bank of {stored} and this bank's runtime questions
+        """
+        return QuestionBank(stored, self.runtime)
+
+    def locate(self, qid: int) -> tuple[QuestionStore, int]:
+        """
+        :return: the store holding question {qid}, and its id there
+        """
+        if qid >= RUNTIME_QID_OFFSET:
+            return self.runtime, qid - RUNTIME_QID_OFFSET
+        return self.stored, qid
+
+    def qid_at(self, position: int) -> int:
+        """
+        :return: the id of the bank's {position}th question, stored questions first
+        """
+        if position < len(self.stored):
+            return position
+        return RUNTIME_QID_OFFSET + position - len(self.stored)
+
+    def next_qid(self) -> int:
+        """
+        :return: the id the next added question gets
+        """
+        return RUNTIME_QID_OFFSET + len(self.runtime)
+
+    def add(self, question: str, answers: list[str], correct_answer: str, category: str = '') -> int:
+        """
+        adds a runtime question
+        :return: the id of the added question
+        """
+        return RUNTIME_QID_OFFSET + self.runtime.add(question, answers, correct_answer, category)
+
+    def question(self, qid: int) -> str:
+        store, qid = self.locate(qid)
+        return store.question(qid)
+
+    def answers(self, qid: int) -> list[str]:
+        store, qid = self.locate(qid)
+        return store.answers(qid)
+
+    def correct_answer(self, qid: int) -> str:
+        store, qid = self.locate(qid)
+        return store.correct_answer(qid)
+
+    def category(self, qid: int) -> str:
+        store, qid = self.locate(qid)
+        return store.category(qid)
+
+    def is_correct(self, qid: int, answer: str) -> bool:
+        return self.correct_answer(qid) == answer
+
+    def get(self, qid: int) -> dict:
+        return {'qid': qid, 'question': self.question(qid), 'answers': self.answers(qid)}
+
+    def questions(self):
+        """
+        yields (question id, question text) of all the questions
+        """
+        yield from self.stored.questions()
+        yield from self.runtime_questions()
+
+    def runtime_questions(self):
+        for qid, question in self.runtime.questions():
+            yield RUNTIME_QID_OFFSET + qid, question
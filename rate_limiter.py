@@ -0,0 +1,117 @@
+import time
+from collections import Counter
+
+###############
+### GLOBALS ###
+###############
+
+# (tokens per second, burst) for each socket-io event, DEFAULT_LIMIT for the rest
+EVENT_LIMITS = {
+    'login': (1, 5),
+    'resume': (1, 5),
+    'play_question': (10, 20),
+    'answer': (10, 20),
+    'register_player': (1, 5),
+    'server_add_question': (2, 10),
+}
+DEFAULT_LIMIT = (10, 20)
+MAX_LOOP_LAG = 0.1  # seconds of event-loop lag before the server starts shedding load
+LAG_CHECK_INTERVAL = 0.05  # seconds between event-loop lag samples
+PRIORITY_EVENTS = {'login', 'resume', 'answer'}  # never shed, so games in progress can finish
+LOAD_DECAY = 0.5  # share of a tenant's recent events count kept at every loop lag sample
+MIN_LOAD = 0.1  # recent events count under which a tenant no longer counts as active
+
+THROTTLED = 'rate'
+SHED = 'overload'
+REJECTION_MESSAGES = {THROTTLED: 'Too many requests, slow down.', SHED: 'The server is busy, try again later.'}
+
+
+class TokenBucket:
+    """
+    a token bucket refilled by {rate} tokens per second, holding at most {capacity} tokens
+    """
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def consume(self, now: float, cost: float = 1) -> bool:
+        """
+        :return: True if there were enough tokens, o/w False
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+
+class RateLimiter:
+    """
+    per sid and per event token buckets, plus an admission controller which sheds non-priority events
+    while the event loop lags behind. it only sheds the events of the tenants (leagues) sending at least
+    an even share of the recent events, so the load of a huge tenant doesn't get a small one's events shed
+    """
+
+    def __init__(self, event_limits: dict = None, default_limit: tuple = DEFAULT_LIMIT,
+                 max_loop_lag: float = MAX_LOOP_LAG):
+        self.event_limits = EVENT_LIMITS if event_limits is None else event_limits
+        self.default_limit = default_limit
+        self.max_loop_lag = max_loop_lag
+        self.loop_lag = 0.0
+        self.buckets = {}  # sid -> {event: TokenBucket}
+        self.tenant_load = {}  # tenant -> events received recently, decayed at every loop lag sample
+        self.throttled = Counter()
+        self.shed = Counter()
+
+    def admit(self, sid, event: str, tenant=None) -> str | None:
+        """
+        checks whether an incoming event should be handled
+        :param tenant: the tenant of the sid, None for the sids that haven't logged in
+        :return: None if admitted, o/w the reason (THROTTLED or SHED)
+        """
+        self.tenant_load[tenant] = self.tenant_load.get(tenant, 0) + 1
+        if self.loop_lag > self.max_loop_lag and event not in PRIORITY_EVENTS and self.is_heavy(tenant):
+            self.shed[event] += 1
+            return SHED
+
+        now = time.monotonic()
+        sid_buckets = self.buckets.setdefault(sid, {})
+        bucket = sid_buckets.get(event)
+        if bucket is None:
+            rate, burst = self.event_limits.get(event, self.default_limit)
+            bucket = sid_buckets[event] = TokenBucket(rate, burst, now)
+        if not bucket.consume(now):
+            self.throttled[event] += 1
+            return THROTTLED
+        return None
+
+    def is_heavy(self, tenant) -> bool:
+        """
+        :return: True if the tenant sent at least an even share of the recent events
+        """
+        return self.tenant_load[tenant] * len(self.tenant_load) >= sum(self.tenant_load.values())
+
+    def record_loop_lag(self, lag: float) -> None:
+        self.loop_lag = lag
+        for tenant, load in list(self.tenant_load.items()):
+            load *= LOAD_DECAY
+            if load < MIN_LOAD:
+                del self.tenant_load[tenant]
+            else:
+                self.tenant_load[tenant] = load
+
+    def forget(self, sid) -> None:
+        """
+        drops the buckets of a disconnected sid
+        """
+        self.buckets.pop(sid, None)
+
+    def stats(self) -> dict:
+        return {'throttled': dict(self.throttled), 'shed': dict(self.shed),
+                'throttled_total': sum(self.throttled.values()), 'shed_total': sum(self.shed.values()),
+                'loop_lag_ms': round(self.loop_lag * 1000, 2)}
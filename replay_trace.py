@@ -0,0 +1,236 @@
+"""
+Replays an event trace recorded by the server (see event_trace.py, TRIVIA_TRACE=path) against a
+local server, at 1x or accelerated speed, preserving each sid's event order and the concurrency
+between sids. Each run's latency and throughput are saved, so two runs can be diffed.
+
+usage: python replay_trace.py replay TRACE [--speed X] [--start wsgi|asgi] [--csv PLAYERS_CSV]
+                                     [--password PW] [--out RUN_JSON]
+       python replay_trace.py diff BASE_RUN_JSON NEW_RUN_JSON
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from collections import defaultdict, deque
+
+import socketio
+
+import bench_io
+import event_trace
+import response_batcher
+
+###############
+### GLOBALS ###
+###############
+
+CALLBACK_EVENTS = ['login_callback', 'play_question_callback', 'answer_callback', 'stats_callback',
+                   'highscore_callback', 'add_question_callback', 'get_logged_in_callback',
+                   'register_player_callback', 'throttle_stats_callback', 'error_callback',
+                   'throttled_callback', 'warming_up_callback', 'analytics_callback', 'resume_callback',
+                   'profile_callback']
+# profile_report_callback is a second response to server_profile, sent when the profiling session ends,
+# so it isn't matched to an event: it has no handler, and is skipped in 'batch' frames
+SESSION_EVENTS = {'connect', 'disconnect'}
+NO_RESPONSE_EVENTS = {'logout'}
+DRAIN_TIMEOUT = 10  # seconds to wait for the responses still outstanding after a sid's last event
+
+
+##############
+### REPLAY ###
+##############
+
+class ReplayClient:
+    """
+    a socket-io client replaying one recorded sid. the server answers each event with a single
+    callback, in order, so responses are matched to the events first-in-first-out
+    """
+
+    def __init__(self):
+        self.sio = socketio.AsyncClient()
+        self.sent = deque()  # (event, send time) of the events still waiting for a response
+        self.latencies = defaultdict(list)
+        for callback in CALLBACK_EVENTS:
+            self.sio.on(callback, self.on_callback)
+        self.sio.on(response_batcher.BATCH_EVENT, self.on_batch)
+
+    async def on_callback(self, data=None) -> None:
+        if self.sent:
+            event, sent_at = self.sent.popleft()
+            self.latencies[event].append(time.perf_counter() - sent_at)
+
+    async def on_batch(self, data) -> None:
+        for event, _ in response_batcher.unpack(data):
+            if event in CALLBACK_EVENTS:
+                await self.on_callback()
+
+    async def drain(self) -> None:
+        deadline = time.perf_counter() + DRAIN_TIMEOUT
+        while self.sent and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+
+
+def restore_password(data, password: str | None):
+    """
+    :return: the recorded data with its redacted password replaced by {password}.
+    redacted resume tokens stay redacted, a password isn't a token
+    """
+    if password is None:
+        return data
+    if isinstance(data, dict):
+        fields = dict(data)
+    elif isinstance(data, str) and event_trace.REDACTED in data:
+        fields = json.loads(data)
+    else:
+        return data
+    if not isinstance(fields, dict):
+        return data
+    if fields.get('password') == event_trace.REDACTED:
+        fields['password'] = password
+    return fields if isinstance(data, dict) else json.dumps(fields)
+
+
+async def replay_sid(url: str, records: list[dict], start: float, speed: float, password: str | None) -> ReplayClient:
+    client = ReplayClient()
+    for record in records:
+        delay = start + record['t'] / speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        event = record['e']
+        if event == 'disconnect':
+            await client.drain()
+            if client.sio.connected:
+                await client.sio.disconnect()
+            continue
+        # a trace may start in the middle of a session
+        if not client.sio.connected:
+            await client.sio.connect(url, transports=['websocket'], auth=response_batcher.BATCH_AUTH)
+        if event in SESSION_EVENTS:
+            continue
+
+        if event not in NO_RESPONSE_EVENTS:
+            client.sent.append((event, time.perf_counter()))
+        await client.sio.emit(event, restore_password(record.get('d'), password))
+
+    await client.drain()
+    if client.sio.connected:
+        await client.sio.disconnect()
+    return client
+
+
+async def replay(url: str, records: list[dict], speed: float, password: str | None) -> dict:
+    by_sid = defaultdict(list)
+    for record in records:
+        by_sid[record['s']].append(record)
+
+    start = time.perf_counter()
+    clients = await asyncio.gather(*[replay_sid(url, sid_records, start, speed, password)
+                                     for sid_records in by_sid.values()])
+    duration = time.perf_counter() - start
+
+    latencies = defaultdict(list)
+    for client in clients:
+        for event, event_latencies in client.latencies.items():
+            latencies[event].extend(event_latencies)
+    return summarize(latencies, sum(len(client.sent) for client in clients), duration, speed)
+
+
+def summarize(latencies: dict[str, list[float]], lost: int, duration: float, speed: float) -> dict:
+    per_event = {}
+    for event, event_latencies in sorted(latencies.items()):
+        event_latencies.sort()
+        per_event[event] = {'count': len(event_latencies),
+                            'mean_ms': statistics.mean(event_latencies) * 1000,
+                            'p50_ms': event_latencies[len(event_latencies) // 2] * 1000,
+                            'p99_ms': event_latencies[max(int(len(event_latencies) * 0.99) - 1, 0)] * 1000}
+    answered = sum(stats['count'] for stats in per_event.values())
+    return {'speed': speed, 'duration_s': duration, 'answered': answered, 'lost': lost,
+            'throughput': answered / duration, 'events': per_event}
+
+
+def replay_command(args) -> None:
+    header, records = event_trace.read_trace(args.trace)
+    print(f'replaying {len(records)} events at {args.speed}x')
+
+    server = None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.start:
+            # the server writes back to its csv file, so it gets a copy
+            csv_path = os.path.join(tmp_dir, 'players.csv')
+            if args.csv:
+                shutil.copy(args.csv, csv_path)
+            else:
+                with open(csv_path, 'w') as csv_file:
+                    csv_file.write(bench_io.PLAYERS_CSV_HEADER)
+            server, _ = bench_io.start_server(args.start, csv_path)
+        try:
+            run = asyncio.run(replay(args.url, records, args.speed, args.password))
+        finally:
+            if server is not None:
+                bench_io.stop_server(server)
+
+    print(f"{run['answered']} responses in {run['duration_s']:.2f}s "
+          f"({run['throughput']:.1f}/s), {run['lost']} lost")
+    for event, stats in run['events'].items():
+        print(f"{event:24}{stats['count']:8}  p50 {stats['p50_ms']:8.2f} ms  p99 {stats['p99_ms']:8.2f} ms")
+    if args.out:
+        with open(args.out, 'w') as out_file:
+            json.dump(run, out_file, indent=2)
+
+
+############
+### DIFF ###
+############
+
+def change(base: float, new: float) -> str:
+    return f'{(new - base) / base * 100:+.1f}%' if base else 'n/a'
+
+
+def diff_command(args) -> None:
+    with open(args.base) as base_file, open(args.new) as new_file:
+        base, new = json.load(base_file), json.load(new_file)
+
+    print(f"throughput  {base['throughput']:10.1f}/s -> {new['throughput']:10.1f}/s  "
+          f"{change(base['throughput'], new['throughput'])}")
+    print(f"lost        {base['lost']:10} -> {new['lost']:10}")
+    print(f"{'event':24}{'p50 base':>10}{'p50 new':>10}{'':>9}{'p99 base':>10}{'p99 new':>10}")
+    for event in sorted(set(base['events']) | set(new['events'])):
+        if event not in base['events'] or event not in new['events']:
+            print(f'{event:24} only in {"base" if event in base["events"] else "new"} run')
+            continue
+        b, n = base['events'][event], new['events'][event]
+        print(f"{event:24}{b['p50_ms']:10.2f}{n['p50_ms']:10.2f}{change(b['p50_ms'], n['p50_ms']):>9}"
+              f"{b['p99_ms']:10.2f}{n['p99_ms']:10.2f}{change(b['p99_ms'], n['p99_ms']):>9}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='replay a recorded event trace and compare runs')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    replay_parser = commands.add_parser('replay', help='replay a trace against a server')
+    replay_parser.add_argument('trace')
+    replay_parser.add_argument('--url', default=bench_io.URL)
+    replay_parser.add_argument('--speed', type=float, default=1, help='1 for real time, 10 for 10x faster')
+    replay_parser.add_argument('--start', choices=list(bench_io.SERVERS),
+                               help='start a local server of this mode for the replay')
+    replay_parser.add_argument('--csv', help='players csv the started server loads (a copy is used)')
+    replay_parser.add_argument('--password', help='password replacing the redacted ones')
+    replay_parser.add_argument('--out', help='save the run\'s results to this json file')
+
+    diff_parser = commands.add_parser('diff', help='compare the results of two runs')
+    diff_parser.add_argument('base')
+    diff_parser.add_argument('new')
+
+    args = parser.parse_args()
+    if args.command == 'replay':
+        replay_command(args)
+    else:
+        diff_command(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import json
+import os
+import zlib
+
+###############
+### GLOBALS ###
+###############
+
+BATCH_EVENT = 'batch'
+COMPRESSION = 'zlib'
+COMPRESSION_THRESHOLD = 1024  # bytes of a frame from which it's compressed, for sids that negotiated it
+COMPRESSION_LEVEL = 6
+COALESCE_ENV = 'TRIVIA_COALESCE'  # set to 0 to emit every response in its own frame
+
+# the auth data a client connects with to negotiate 'batch' frames, and their compression.
+# the responses to other clients are always emitted as they are
+BATCH_AUTH = {'batch': True, 'compression': [COMPRESSION]}
+
+
+def accepts_batches(auth) -> bool:
+    """
+    :param auth: the auth data the client connected with
+    """
+    return isinstance(auth, dict) and auth.get('batch') is True
+
+
+def accepts_compression(auth) -> bool:
+    """
+    :param auth: the auth data the client connected with
+    """
+    return accepts_batches(auth) and COMPRESSION in (auth.get('compression') or ())
+
+
+def unpack(data) -> list:
+    """
+    client side of a 'batch' frame
+    :param data: the frame's data, a list of [event, data] pairs or the zlib-compressed json of one
+    :return: the (event, data) responses of the frame, in order
+    """
+    if isinstance(data, bytes):
+        return json.loads(zlib.decompress(data))
+    return data
+
+
+class ResponseBatcher:
+    """
+    coalesces the responses queued for a sid within one event-loop tick into a single frame,
+    for the sids that negotiated 'batch' frames when they connected (see BATCH_AUTH):
+    the transport put()s every response, and take()s the sid's frame once the tick is over.
+    a frame holding several responses is a 'batch' event with a list of [event, data] pairs.
+    frames over COMPRESSION_THRESHOLD bytes are sent as a 'batch' of the list's zlib-compressed json
+    to the sids that negotiated compression as well
+    """
+
+    def __init__(self, coalesce: bool = True):
+        self.coalesce = coalesce
+        self.queues = {}  # sid -> responses waiting for the end of the tick
+        self.batching = set()  # sids that negotiated 'batch' frames
+        self.compressing = set()  # sids that negotiated compression
+
+    @classmethod
+    def from_env(cls) -> 'ResponseBatcher':
+        return cls(coalesce=os.environ.get(COALESCE_ENV, '1') != '0')
+
+    def negotiate(self, sid, auth) -> None:
+        if accepts_batches(auth):
+            self.batching.add(sid)
+        if accepts_compression(auth):
+            self.compressing.add(sid)
+
+    def forget(self, sid) -> None:
+        self.queues.pop(sid, None)
+        self.batching.discard(sid)
+        self.compressing.discard(sid)
+
+    def coalesces(self, sid) -> bool:
+        """
+        :return: True if the sid's responses are to be put() and take()n, o/w they're emitted as they are
+        """
+        return self.coalesce and sid in self.batching
+
+    def put(self, sid, response: tuple[str, str]) -> bool:
+        """
+        queues a response for the end of the tick
+        :return: True if it's the first response queued for the sid this tick,
+        so the transport must schedule a take()
+        """
+        queue = self.queues.setdefault(sid, [])
+        queue.append(response)
+        return len(queue) == 1
+
+    def take(self, sid):
+        """
+        :return: the (event, data) frame of the responses queued for the sid, None if there are none
+        """
+        responses = self.queues.pop(sid, None)
+        return None if not responses else self.frame(sid, responses)
+
+    def frame(self, sid, responses: list[tuple[str, str]]):
+        """
+        :return: the (event, data) frame carrying {responses}
+        """
+        size = sum(len(data) for _, data in responses)
+        if sid in self.compressing and size >= COMPRESSION_THRESHOLD:
+            compressed = zlib.compress(json.dumps(responses).encode(), COMPRESSION_LEVEL)
+            # short or random payloads may not shrink
+            if len(compressed) < size:
+                return BATCH_EVENT, compressed
+        if len(responses) == 1:
+            return responses[0]
+        return BATCH_EVENT, [list(response) for response in responses]
@@ -0,0 +1,73 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+
+###############
+### GLOBALS ###
+###############
+
+TOKEN_TTL = 300  # seconds a resume token stays valid
+SECRET_ENV = 'TRIVIA_RESUME_SECRET'
+SECRET_FILE = '.resume_secret'
+SIGNATURE_LENGTH = 16  # bytes of the hmac kept in the token
+
+
+def load_secret() -> bytes:
+    """
+    :return: the signing key from SECRET_ENV, or from SECRET_FILE (created on first use),
+    so tokens stay valid when the server restarts within their ttl
+    """
+    secret = os.environ.get(SECRET_ENV)
+    if secret:
+        return secret.encode()
+    try:
+        with open(SECRET_FILE, 'rb') as secret_file:
+            return secret_file.read()
+    except FileNotFoundError:
+        pass
+    # write the key aside, then link it into place: of concurrent workers, the first to link wins,
+    # and the others read its complete key rather than an empty or partly written file
+    secret = secrets.token_bytes(32)
+    temp_path = f'{SECRET_FILE}.{os.getpid()}.{secrets.token_hex(4)}.tmp'
+    descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        with os.fdopen(descriptor, 'wb') as secret_file:
+            secret_file.write(secret)
+        os.link(temp_path, SECRET_FILE)
+    except FileExistsError:
+        with open(SECRET_FILE, 'rb') as secret_file:
+            return secret_file.read()
+    finally:
+        os.unlink(temp_path)
+    return secret
+
+
+def sign(secret: bytes, payload: str) -> str:
+    digest = hmac.new(secret, payload.encode(), hashlib.sha256).digest()[:SIGNATURE_LENGTH]
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+
+def issue(secret: bytes, league: str, player_id: int, generation: int = 0, ttl: int = TOKEN_TTL) -> str:
+    """
+    :param generation: the player's token generation, bumped on logout to revoke the tokens issued before
+    :return: a token '<league>.<player id>.<generation>.<expiry>.<signature>' letting the player resume its session
+    """
+    payload = f'{league}.{player_id}.{generation}.{int(time.time()) + ttl}'
+    return f'{payload}.{sign(secret, payload)}'
+
+
+def verify(secret: bytes, token: str) -> tuple[str, int, int] | None:
+    """
+    :return: the token's league, player id and generation, or None if the token is malformed, forged or expired
+    """
+    try:
+        league, player_id, generation, expiry, signature = token.split('.')
+        payload = f'{league}.{player_id}.{generation}.{expiry}'
+        if not hmac.compare_digest(signature, sign(secret, payload)) or int(expiry) < time.time():
+            return None
+        return league, int(player_id), int(generation)
+    except (AttributeError, ValueError):
+        return None
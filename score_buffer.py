@@ -0,0 +1,88 @@
+import os
+
+###############
+### GLOBALS ###
+###############
+
+FLUSH_INTERVAL = 0.1  # seconds between group commits of the buffered score deltas
+SAVE_ENV = 'TRIVIA_SAVE_INTERVAL'
+# seconds between writes of the changed players to the csv files. a write rewrites a league's whole file,
+# so it's much rarer than the group commits, and the final write on shutdown saves the rest
+SAVE_INTERVAL = float(os.environ.get(SAVE_ENV, 5))
+STATS_COLUMNS = ['score', 'games_played', 'wins_in_row']
+
+
+class PlayerDelta:
+    """
+    the score changes of a single player since the last flush.
+    when {streak_reset} is set, {wins_in_row} replaces the stored streak instead of adding to it
+    """
+    __slots__ = ('score', 'games_played', 'wins_in_row', 'streak_reset')
+
+    def __init__(self):
+        self.score = 0
+        self.games_played = 0
+        self.wins_in_row = 0
+        self.streak_reset = False
+
+    def apply(self, score: int, games_played: int, wins_in_row: int) -> tuple[int, int, int]:
+        """
+        :return: the stats after applying the delta to the given stats
+        """
+        wins_in_row = self.wins_in_row if self.streak_reset else wins_in_row + self.wins_in_row
+        return score + self.score, games_played + self.games_played, wins_in_row
+
+
+class ScoreBuffer:
+    """
+    a write-behind buffer coalescing the answers' score, streak and games-played changes per player,
+    applied to the players data frame in one batch instead of several writes per answer
+    """
+
+    def __init__(self):
+        self.pending = {}  # players data frame index -> PlayerDelta
+        self.unsaved = False
+
+    def record_answer(self, index, correct: bool, points: int) -> None:
+        delta = self.pending.get(index)
+        if delta is None:
+            delta = self.pending[index] = PlayerDelta()
+        delta.games_played += 1
+        if correct:
+            delta.score += points
+            delta.wins_in_row += 1
+        else:
+            delta.wins_in_row = 0
+            delta.streak_reset = True
+
+    def view(self, index, score: int, games_played: int, wins_in_row: int) -> tuple[int, int, int]:
+        """
+        read-your-writes: the stored stats of a player with its buffered changes applied
+        """
+        delta = self.pending.get(index)
+        if delta is None:
+            return score, games_played, wins_in_row
+        return delta.apply(score, games_played, wins_in_row)
+
+    def apply(self, players) -> int:
+        """
+        applies all the buffered changes to the players data frame with a single read and write
+        :return: the number of players updated
+        """
+        if not self.pending:
+            return 0
+        pending, self.pending = self.pending, {}
+        index = list(pending)
+        stats = players.loc[index, STATS_COLUMNS].to_numpy()
+        for row, delta in zip(stats, pending.values()):
+            row[:] = delta.apply(*row)
+        players.loc[index, STATS_COLUMNS] = stats
+        self.unsaved = True
+        return len(index)
+
+    def take_unsaved(self) -> bool:
+        """
+        :return: True if changes were applied since the last call, i.e. the csv file is behind
+        """
+        unsaved, self.unsaved = self.unsaved, False
+        return unsaved
@@ -0,0 +1,245 @@
+"""
+An asyncio alternative to server_io.py: the same trivia_core handlers served by
+socketio.AsyncServer as an ASGI app (uvicorn picks uvloop and httptools when installed).
+Blocking work (web requests, csv persistence) is run in the default executor.
+"""
+import time
+
+LAUNCH_TIME = time.perf_counter()
+
+import asyncio
+import logging
+
+import socketio
+import uvicorn
+
+import league
+import rate_limiter
+import score_buffer
+import trivia_core
+
+
+###########################
+### BASIC CONFIGURATION ###
+###########################
+
+async def run_blocking(func, *args):
+    """
+    runs a blocking function in the default executor so the event loop keeps serving
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+async def monitor_loop_lag() -> None:
+    """
+    samples how late the event loop wakes a sleeping task,
+    feeding the rate limiter's admission controller
+    """
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(rate_limiter.LAG_CHECK_INTERVAL)
+        trivia_core.limiter.record_loop_lag(time.monotonic() - start - rate_limiter.LAG_CHECK_INTERVAL)
+
+
+async def flush_scores_loop() -> None:
+    """
+    group-commits the buffered score changes to the players data frames every FLUSH_INTERVAL,
+    and every SAVE_INTERVAL writes a snapshot of every changed league's players to its csv file in the executor
+    """
+    next_save = time.monotonic() + score_buffer.SAVE_INTERVAL
+    while True:
+        await asyncio.sleep(score_buffer.FLUSH_INTERVAL)
+        trivia_core.flush_scores()
+        if time.monotonic() < next_save:
+            continue
+        next_save = time.monotonic() + score_buffer.SAVE_INTERVAL
+        for tenant in trivia_core.unsaved_leagues():
+            await run_blocking(tenant.write_to_csv, tenant.players.copy())
+
+
+async def reload_banks_loop() -> None:
+    """
+    picks up new versions of the questions store files without a restart:
+    maps and indexes them in the executor, then swaps them in
+    """
+    while True:
+        await asyncio.sleep(league.BANK_CHECK_INTERVAL)
+        for tenant in trivia_core.changed_banks():
+            # a bad file (e.g. one still being copied in place) is retried on the next check,
+            # and never stops the loop for the other leagues
+            try:
+                bank = await run_blocking(tenant.read_bank)
+            except Exception as e:
+                logging.info(msg=f'Exception>> reload_banks_loop>> {tenant.name}: {e!r}')
+                continue
+            tenant.swap_bank(*bank)
+
+
+background_tasks = set()  # keeps references to the server's long-running tasks
+flush_scores_task = None  # the flush_scores_loop task, stopped by cleanup
+
+
+first_connection_reported = False
+
+
+async def startup() -> None:
+    global flush_scores_task
+    # don't hold uvicorn's bind back: load the questions and players while accepting connections
+    trivia_core.configure_logging()
+    trivia_core.start_tracing()
+    background_tasks.add(asyncio.create_task(run_blocking(trivia_core.load_state_or_exit)))
+    background_tasks.add(asyncio.create_task(monitor_loop_lag()))
+    flush_scores_task = asyncio.create_task(flush_scores_loop())
+    background_tasks.add(flush_scores_task)
+    background_tasks.add(asyncio.create_task(reload_banks_loop()))
+
+
+async def cleanup() -> None:
+    print('-^--^-\n--ww--')
+    logging.info(msg='server cleans up and shuts down')
+    for sid in trivia_core.connected_sids():
+        await sio.disconnect(sid=sid)
+        logging.info(msg=f'{sid} disconnected')
+    # stop the periodic writes before the final one
+    if flush_scores_task is not None:
+        flush_scores_task.cancel()
+        await asyncio.gather(flush_scores_task, return_exceptions=True)
+    trivia_core.flush_scores()
+    await run_blocking(trivia_core.write_to_csv)
+    trivia_core.stop_tracing()
+    print('exiting...')
+
+
+######################
+### SOCKET METHODS ###
+######################
+
+sio = socketio.AsyncServer(async_mode='asgi')
+app = socketio.ASGIApp(sio, static_files={'/': './content/'}, on_startup=startup, on_shutdown=cleanup)
+
+
+async def emit(sid, response: trivia_core.Response) -> None:
+    """
+    sends a handler's response back to the client,
+    in one frame with the other responses queued for it until the loop's next iteration
+    :param sid: the session id of the client to be sent to
+    :param response: the (event, data) pair returned by a trivia_core handler
+    """
+    if not trivia_core.batcher.coalesces(sid):
+        await send_frame(sid, trivia_core.batcher.frame(sid, [response]))
+    elif trivia_core.batcher.put(sid, response):
+        task = asyncio.create_task(flush_frame(sid))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
+async def flush_frame(sid) -> None:
+    # let the handlers already scheduled on this iteration queue their responses, without delaying a lone one
+    await asyncio.sleep(0)
+    frame = trivia_core.batcher.take(sid)
+    if frame is not None:
+        await send_frame(sid, frame)
+
+
+async def send_frame(sid, frame) -> None:
+    event, data = frame
+    await sio.emit(event=event, data=data, to=sid)
+
+
+@sio.event
+async def connect(sid, environ, auth=None) -> None:
+    global first_connection_reported
+    if trivia_core.trace is not None:
+        trivia_core.trace.record(sid, 'connect')
+    trivia_core.batcher.negotiate(sid, auth)
+    if not first_connection_reported:
+        first_connection_reported = True
+        startup_msg = f'first connection accepted {(time.perf_counter() - LAUNCH_TIME) * 1000:.1f} ms after launch'
+        print('[SERVER] ', startup_msg)
+        logging.info(msg=startup_msg)
+    print(sid, 'connected...')
+    logging.info(msg=f'{sid} connected')
+
+
+@sio.event
+async def disconnect(sid) -> None:
+    if trivia_core.trace is not None:
+        trivia_core.trace.record(sid, 'disconnect')
+    trivia_core.disconnect_handler(sid)
+    print(sid, 'disconnected...')
+    logging.info(msg=f'{sid} disconnected')
+
+
+async def send_error(sid, error_msg: str, event: str = 'error_callback') -> None:
+    """
+    sends an error with a message
+    :param sid: the session id of the client to be sent to
+    :param error_msg: an error message to be sent
+    :type error_msg: str
+    :param event: the callback event of the error
+    """
+    await emit(sid, trivia_core.build_error(error_msg, event))
+
+
+################
+### Handlers ###
+################
+
+def register_handler(event: str, handler) -> None:
+    """
+    binds a trivia_core handler to a socket-io event
+    """
+    async def on_event(sid, data=None) -> None:
+        if trivia_core.trace is not None:
+            trivia_core.trace.record(sid, event, data)
+        rejection = trivia_core.limiter.admit(sid, event, trivia_core.session_league(sid))
+        if rejection is not None:
+            await emit(sid, trivia_core.REJECTIONS[rejection])
+            return
+        if not trivia_core.ready:
+            await send_error(sid, trivia_core.WARMING_UP_MSG, event='warming_up_callback')
+            return
+        if trivia_core.profiler.active:
+            response = trivia_core.profiler.time_handler(event, handler, sid, data)
+        else:
+            response = handler(sid, data)
+        await emit(sid, response)
+
+    sio.on(event, on_event)
+
+
+for event_name, core_handler in trivia_core.HANDLERS.items():
+    register_handler(event_name, core_handler)
+
+
+async def finish_profile_later(sid, seconds: int) -> None:
+    await asyncio.sleep(seconds)
+    await emit(sid, trivia_core.finish_profile())
+
+
+@sio.on('server_profile')
+async def profile_handler(sid, data=None) -> None:
+    if trivia_core.trace is not None:
+        trivia_core.trace.record(sid, 'server_profile', data)
+    response, seconds = trivia_core.start_profile_handler(sid, data)
+    await emit(sid, response)
+    if seconds:
+        task = asyncio.create_task(finish_profile_later(sid, seconds))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
+@sio.on('logout')
+async def logout_handler(sid):
+    if trivia_core.trace is not None:
+        trivia_core.trace.record(sid, 'logout')
+    trivia_core.logout_handler(sid)
+    await sio.disconnect(sid)
+
+
+###################
+### APP PROCESS ###
+###################
+
+if __name__ == '__main__':
+    uvicorn.run(app, host=trivia_core.HOST, port=trivia_core.PORT, loop='auto', log_level='warning')
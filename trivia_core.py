@@ -0,0 +1,571 @@
+import random
+import logging
+import os
+import time
+import sys
+import json
+
+import event_trace
+import helpers
+import league
+import profiling_hooks
+import question_stats
+import rate_limiter
+import response_batcher
+import resume_token
+import score_buffer
+
+###############
+### GLOBALS ###
+###############
+
+HOST = '127.0.0.1'
+PORT = 8080
+WARMING_UP_MSG = 'The server is warming up, try again in a moment.'
+LOGIN_REQUIRED_MSG = 'Please log in first.'
+
+# pandas and requests are imported lazily, so the server binds its socket before paying for them.
+# the leagues are loaded by load_state(), and handlers must not be called until {ready} is set
+leagues = {}  # league name -> league.League, each holding its own players and questions bank
+ready = False
+
+sessions = {}  # sid -> (league.League, players index) of the logged-in player
+resume_secret = None  # signs the resume tokens
+
+limiter = rate_limiter.RateLimiter()
+# the responses to throttled and shed events, built once: a flood is rejected without printing or
+# serializing anything per event. limiter.stats() counts the rejections
+REJECTIONS = {reason: ('throttled_callback', json.dumps({'result': 'ERROR', 'msg': msg}))
+              for reason, msg in rate_limiter.REJECTION_MESSAGES.items()}
+batcher = response_batcher.ResponseBatcher.from_env()
+profiler = profiling_hooks.ProfileSession()
+trace = None  # event_trace.TraceRecorder of the inbound events, when recording is on
+
+# a response is the (event, json data) pair a transport emits back to the sender
+Response = tuple[str, str]
+
+
+###########################
+### BASIC CONFIGURATION ###
+###########################
+
+def configure_logging() -> None:
+    logging.basicConfig(filename='trivia_logger.log', level=logging.INFO, filemode='a',
+                        format="%(asctime)s>> %(levelname)s>> %(msg)s;", datefmt='%d/%m/%y-%H:%M')
+
+
+def start_tracing() -> None:
+    """
+    starts recording the inbound events if the event_trace.TRACE_ENV environment variable names a file
+    """
+    global trace
+    trace = event_trace.TraceRecorder.from_env()
+    if trace is not None:
+        logging.info(msg=f'recording inbound events to {trace.file.name}')
+
+
+def stop_tracing() -> None:
+    if trace is not None:
+        trace.close()
+
+
+def connected_sids() -> list:
+    """
+    :return: the session ids of all the logged-in players
+    """
+    return [sid for tenant in leagues.values() if tenant.players is not None
+            for sid in tenant.players['sid'].values if sid is not None]
+
+
+def session_league(sid) -> league.League | None:
+    """
+    :return: the league of the logged-in player, None for sessions that haven't logged in,
+    which league-scoped handlers answer with LOGIN_REQUIRED_MSG
+    """
+    session = sessions.get(sid)
+    return None if session is None else session[0]
+
+
+####################
+### DATA LOADERS ###
+####################
+
+def questions_path() -> str | None:
+    """
+    :return: the questions store file given as the second command line argument, if any
+    """
+    return sys.argv[2] if len(sys.argv) > 2 else None
+
+
+def discover_leagues() -> None:
+    """
+    creates the default league from the command line arguments, and a league for every
+    players.<league>.csv file next to its players csv file (with its own questions.<league> store file)
+    """
+    players_path, bank_path = sys.argv[1], questions_path()
+    for name in league.discover_leagues(players_path):
+        leagues[name] = league.League(name, league.league_file(players_path, name),
+                                      None if bank_path is None else league.league_file(bank_path, name))
+
+
+def load_state() -> None:
+    """
+    loads the questions and the players of every league.
+    blocking, so servers run it in the background while already accepting connections
+    """
+    global ready, resume_secret
+    start = time.perf_counter()
+    resume_secret = resume_token.load_secret()
+    discover_leagues()
+    for tenant in leagues.values():
+        tenant.load()
+    ready = True
+    logging.info(msg=f'questions and players of {len(leagues)} leagues loaded in {time.perf_counter() - start:.2f}s')
+
+
+def load_state_or_exit() -> None:
+    """
+    load_state for the servers' background loaders: a server that can't load its state
+    would answer warming_up_callback forever, so it logs the failure and exits instead
+    """
+    try:
+        load_state()
+    except Exception as e:
+        logging.exception(msg=f'Exception>> load_state>> {e}')
+        print('[SERVER] ', f'failed to load the questions and players: {e!r}', file=sys.stderr, flush=True)
+        # runs in a worker thread, where sys.exit would only end the thread
+        os._exit(1)
+
+
+def write_to_csv() -> None:
+    """
+    final write of the players of every league to its csv file, on shutdown
+    """
+    for tenant in leagues.values():
+        tenant.write_to_csv(final=True)
+
+
+def flush_scores() -> None:
+    """
+    applies the buffered score changes to the players data frames
+    """
+    if ready:
+        for tenant in leagues.values():
+            tenant.flush_scores()
+
+
+def unsaved_leagues() -> list[league.League]:
+    """
+    :return: the leagues whose players have changes not yet written to their csv file
+    """
+    if not ready:
+        return []
+    return [tenant for tenant in leagues.values() if tenant.take_unsaved()]
+
+
+def changed_banks() -> list[league.League]:
+    """
+    :return: the leagues whose questions store file has a new version, e.g. from ingest_questions.py
+    """
+    if not ready:
+        return []
+    return [tenant for tenant in leagues.values() if tenant.bank_changed()]
+
+
+################
+### Handlers ###
+################
+
+def build_error(error_msg: str, event: str = 'error_callback') -> Response:
+    """
+    builds an error response with a message
+    :param error_msg: an error message to be sent
+    :type error_msg: str
+    :param event: the callback event of the error
+    """
+    data = {'result': 'ERROR', 'msg': error_msg}
+    print('[SERVER] ', error_msg)
+    return event, json.dumps(data)
+
+
+def disconnect_handler(sid) -> None:
+    limiter.forget(sid)
+    batcher.forget(sid)
+    session = sessions.pop(sid, None)
+    if session is None:
+        return
+    tenant, index = session
+    # the player may have resumed on a new sid already
+    if tenant.players.at[index, 'sid'] == sid:
+        tenant.players.at[index, 'sid'] = None
+
+
+def logout_handler(sid) -> None:
+    """
+    revokes the resume tokens of the logged-in player, so a logout can't be undone by resuming.
+    the transport disconnects the sid afterwards
+    """
+    session = sessions.get(sid)
+    if session is None:
+        return
+    tenant, index = session
+    player_id = int(tenant.players.at[index, 'id'])
+    tenant.token_generations[player_id] = tenant.token_generations.get(player_id, 0) + 1
+
+
+def check_correct_username_n_password(players, username: str, password: str) -> bool:
+    """
+    checks if the username and password are correct,
+    login_handler helper function
+    """
+    if username not in players['username'].values:
+        return False
+    elif players.loc[players['username'] == username]['password'].values[0] != password:
+        return False
+    else:
+        return True
+
+
+def check_user_logged_in(players, user: str, password: str) -> bool:
+    """
+    check if the user has already logged in,
+    login_handler helper function
+    :return: True if the user has already logged in, o/w False
+    """
+    return players.loc[(players['username'] == user) & (players['password'] == password)]['sid'].values[0]
+
+
+def check_user_permission(players, user: str, password: str, user_type: bool) -> bool:
+    """
+    check if the user tried to access the back office without having permission,
+    login_handler helper function
+    :return: True if the user tried to access the back office without permission
+    """
+    return user_type != players.loc[(players['username'] == user) &
+                                    (players['password'] == password)]['is_manager'].values[0]
+
+
+def login_handler(sid, data: str) -> Response:
+    data = json.loads(data)
+    if data['command'] != helpers.PROTOCOL_CLIENT['login']:
+        return build_error('Wrong direction')
+
+    data_to_send = {'protocol': 'server', 'command': helpers.PROTOCOL_SERVER['login']}
+    try:
+        user, password = data['username'], data['password']
+        user_type = helpers.PROTOCOL_USER_TYPE[data['user_type']]
+        tenant = leagues.get(data.get('league') or league.DEFAULT_LEAGUE)
+
+        # check the league exists, players of one league are unknown to the others
+        if tenant is None:
+            data_to_send['msg'] = "Unknown league"
+            data_to_send['result'] = 'FAILURE'
+
+        # check username and password correctness
+        elif not check_correct_username_n_password(tenant.players, user, password):
+            data_to_send['msg'] = "Incorrect username or password"
+            data_to_send['result'] = 'FAILURE'
+
+        # check if user has already logged in
+        elif check_user_logged_in(tenant.players, user, password):
+            data_to_send['msg'] = f'{user} has already logged in.'
+            data_to_send['result'] = 'FAILURE'
+
+        # check if user tried to log in without the right permission
+        elif check_user_permission(tenant.players, user, password, user_type):
+            data_to_send['msg'] = "Access Denied."
+            data_to_send['result'] = 'FAILURE'
+
+        # the user has successfully logged in
+        else:
+            players = tenant.players
+            index = players.loc[(players['username'] == user) & (players['password'] == password)].index[0]
+            players.at[index, 'sid'] = sid  # update the session id of the user
+            sessions[sid] = tenant, index
+            data_to_send['msg'] = 'Successfully logged in'
+            data_to_send['result'] = 'ACK'
+            player_id = int(players.at[index, 'id'])
+            data_to_send['resume_token'] = resume_token.issue(resume_secret, tenant.name, player_id,
+                                                              tenant.token_generations.get(player_id, 0))
+            logging.info(msg=f'{user} successfully logged in to league {tenant.name}')
+
+    except AttributeError as e:
+        return build_error('Failed to log in. Try again.')
+    except Exception as ex:
+        logging.info(msg=f'Exception>> login_handler>> {ex}')
+        logging.info(msg=f'Something wrong happened when a user tried to log in.\nsid: {sid}')
+        return build_error('Failed to log in. Try again.')
+    else:
+        print('[SERVER] ', data_to_send['msg'])
+        return 'login_callback', json.dumps(data_to_send)
+
+
+def resume_handler(sid, data: str) -> Response:
+    """
+    rebinds a reconnecting client to its player, its pending question and its streak
+    by the resume token it got at login, without checking its credentials again
+    """
+    data_to_send = {'result': 'FAILURE', 'protocol': 'server', 'msg': 'Session expired, please log in again.'}
+    try:
+        name, player_id, generation = resume_token.verify(resume_secret, json.loads(data)['resume_token'])
+    except (TypeError, ValueError, KeyError):
+        name, player_id, generation = None, None, None
+    tenant = leagues.get(name)
+    index = None if tenant is None else tenant.player_index.get(player_id)
+    # tokens issued before the player logged out are revoked
+    if index is None or generation != tenant.token_generations.get(player_id, 0):
+        return 'resume_callback', json.dumps(data_to_send)
+
+    # the server may not have noticed the old socket dropped yet
+    sessions.pop(tenant.players.at[index, 'sid'], None)
+    tenant.players.at[index, 'sid'] = sid
+    sessions[sid] = tenant, index
+
+    pending = tenant.pending_questions.get(player_id)
+    data_to_send['result'] = 'ACK'
+    data_to_send['msg'] = 'Session resumed'
+    data_to_send['resume_token'] = resume_token.issue(resume_secret, tenant.name, player_id, generation)
+    data_to_send['pending_question'] = None if pending is None else tenant.questions_bank.get(pending[0])
+    logging.info(msg=f'player {player_id} resumed its session on {sid}')
+    return 'resume_callback', json.dumps(data_to_send)
+
+
+def create_random_question(tenant: league.League) -> dict:
+    bank = tenant.questions_bank
+    return bank.get(bank.qid_at(random.randrange(len(bank))))
+
+
+def play_question_handler(sid, data=None) -> Response:
+    tenant = session_league(sid)
+    if tenant is None:
+        return build_error(LOGIN_REQUIRED_MSG)
+    if not len(tenant.questions_bank):
+        return build_error('There are no questions yet.')
+    question_data = create_random_question(tenant)
+    # remember the question, so a player resuming its session can still answer it
+    player_id = int(tenant.players.at[sessions[sid][1], 'id'])
+    tenant.pending_questions[player_id] = question_data['qid'], time.monotonic()
+    question_data['command'] = helpers.PROTOCOL_SERVER['question']
+    print('[SERVER] ', question_data)
+    return 'play_question_callback', json.dumps(question_data)
+
+
+def answer_handler(sid, data: str) -> Response:
+    data = json.loads(data)
+    # check for the right direction
+    if data['command'] != helpers.PROTOCOL_CLIENT['ans']:
+        return build_error('Wrong direction')
+    ans = data['answer']
+
+    if sid not in sessions:
+        return build_error(LOGIN_REQUIRED_MSG)
+    tenant, user_index = sessions[sid]
+    try:
+        qid = int(data['question_id'])
+        correct = tenant.questions_bank.is_correct(qid, ans)
+    except (TypeError, ValueError, IndexError):
+        return build_error('Unknown question.')
+    player_id = int(tenant.players.at[user_index, 'id'])
+    pending = tenant.pending_questions.pop(player_id, None)
+    data_to_send = {'result': 'FAILED', 'protocol': 'server', 'command': helpers.PROTOCOL_SERVER['ans'], 'msg': ''}
+
+    # only answers to the question the player was asked last count in the analytics,
+    # so a client can't skew a question's stats by answering it at will
+    if pending is not None and pending[0] == qid:
+        tenant.answer_stats.record_answer(qid, tenant.questions_bank.category(qid), player_id, correct,
+                                          time.monotonic() - pending[1])
+
+    # check if the user is correct, the score changes are written behind by flush_scores
+    if correct:
+        tenant.scores.record_answer(user_index, correct=True, points=5)
+
+        data_to_send['msg'] = 'Correct answer.\nYOU GOT 5 POINTS.'
+        data_to_send['result'] = 'ACK'
+    else:
+        tenant.scores.record_answer(user_index, correct=False, points=0)
+        data_to_send['result'] = 'ACK'
+        data_to_send['msg'] = 'WRONG ANSWER.'
+    return 'answer_callback', json.dumps(data_to_send)
+
+
+def get_stats_handler(sid, data=None) -> Response:
+    tenant = session_league(sid)
+    if tenant is None:
+        return build_error(LOGIN_REQUIRED_MSG)
+    score = tenant.players.loc[tenant.players['sid'] == sid][score_buffer.STATS_COLUMNS].copy()
+    # read through the buffer, so the player sees its latest answers
+    for index in score.index:
+        score.loc[index] = tenant.scores.view(index, *score.loc[index])
+    data_to_send = {'result': 'ACK', 'protocol': 'server', 'command': helpers.PROTOCOL_SERVER['stats'],
+                    'msg': str(score)}
+    print('[SERVER] ', data_to_send)
+    return 'stats_callback', json.dumps(data_to_send)
+
+
+def get_highscore_handler(sid, data=None) -> Response:
+    tenant = session_league(sid)
+    if tenant is None:
+        return build_error(LOGIN_REQUIRED_MSG)
+    tenant.scores.apply(tenant.players)
+    highscore = tenant.players.sort_values(by=['score'], ascending=False)[['username', 'score']].head(10)
+    data_to_send = {'result': 'ACK', 'protocol': 'server', 'command': helpers.PROTOCOL_SERVER['highscore'],
+                    'msg': highscore.to_string(index=False)}
+    print('[SERVER] ', data_to_send)
+    return 'highscore_callback', json.dumps(data_to_send)
+
+
+def add_question_handler(sid, data: str) -> Response:
+    tenant = session_league(sid)
+    if tenant is None:
+        return build_error(LOGIN_REQUIRED_MSG)
+    try:
+        q_data = json.loads(data)
+        if tenant.questions_index.find_duplicate(q_data['question']) is not None:
+            logging.info(msg=f'tried to add an existing question: {q_data["question"]}')
+            return build_error('The question already exists.')
+        qid = tenant.questions_bank.add(q_data['question'], q_data['answers'], q_data['correct_answer'])
+        tenant.questions_index.add(q_data['question'], qid)
+        data_to_send = {'result': 'ACK', 'protocol': 'server', 'command': helpers.PROTOCOL_SERVER['add_succ']}
+    except Exception as e:
+        logging.info(msg='Failed to add question')
+        logging.info(msg=f'Exception>> add_question_handler>> {e}')
+        return build_error('Failed to add the question.')
+    else:
+        logging.info(msg='successfully added question')
+        return 'add_question_callback', json.dumps(data_to_send)
+
+
+def get_logged_in_users_handler(sid, data=None) -> Response:
+    tenant = session_league(sid)
+    if tenant is None:
+        return build_error(LOGIN_REQUIRED_MSG)
+    players = tenant.players
+    logged_in_users = players.loc[players['sid'].notnull()][['username', 'id']]
+    data_to_send = {'result': 'ACK', 'protocol': 'server', 'command': helpers.PROTOCOL_SERVER['logged_in'],
+                    'msg': logged_in_users.to_string()}
+    print('[SERVER] ', data_to_send)
+    return 'get_logged_in_callback', json.dumps(data_to_send)
+
+
+def register_player_handler(sid, data: str) -> Response:
+    tenant = session_league(sid)
+    if tenant is None:
+        return build_error(LOGIN_REQUIRED_MSG)
+    try:
+        data = json.loads(data)
+        username, password = data['username'], data['password']
+    except TypeError as te:
+        logging.info(msg=f'Error>> register_player_handler>> {te}')
+        logging.info(msg='can\'t parse data')
+        return build_error('can\'t parse data')
+
+    # username must be unique within the league
+    # check if username has already registered
+    players = tenant.players
+    if username in players['username'].values:
+        logging.info(msg=f'tried to register an existing player, username: {username}')
+        data_to_send = {'result': 'Failure', 'protocol': 'server', 'command': helpers.PROTOCOL_SERVER['reg_fail'],
+                        'msg': f"Username \'{username}\' has already registered"}
+        return 'register_player_callback', json.dumps(data_to_send)
+
+    try:
+        player_id = 1 if players.empty else int(players.id.max()) + 1
+        players.loc[len(players.index)] = [username, password, 0, False, player_id, None, 0, 0]
+        tenant.player_index[player_id] = len(players.index) - 1
+        ack_msg = f'Successfully registered {username}'
+        print(f'[SERVER] ', ack_msg)
+    except Exception as e:
+        logging.info(msg=f'Exception>> register_player_handler>> {e}')
+        return build_error('Failed to register player')
+    else:
+        logging.info(msg=ack_msg)
+        data_to_send = {'result': 'ACK', 'protocol': 'server', 'command': helpers.PROTOCOL_SERVER['reg_succ'],
+                        'msg': ack_msg}
+        return 'register_player_callback', json.dumps(data_to_send)
+
+
+def get_throttle_stats_handler(sid, data=None) -> Response:
+    data_to_send = {'result': 'ACK', 'protocol': 'server', 'msg': limiter.stats()}
+    return 'throttle_stats_callback', json.dumps(data_to_send)
+
+
+def get_analytics_handler(sid, data=None) -> Response:
+    """
+    reports the hardest questions, the accuracy by category and the active players per hour
+    of the manager's league, from the aggregates kept up to date by answer_handler
+    """
+    if not is_manager_sid(sid):
+        logging.info(msg=f'{sid} tried to view the analytics without permission')
+        return build_error('Access Denied.')
+    tenant = session_league(sid)
+    stats = tenant.answer_stats
+
+    lines = [f'Hardest {question_stats.HARDEST_COUNT} questions (with {question_stats.MIN_ANSWERS}+ answers):']
+    for qid, counters in stats.hardest():
+        average_time = counters.average_time()
+        average_time = '-' if average_time is None else f'{average_time:.1f}s'
+        lines.append(f'{counters.correct_rate():7.1%} of {counters.answered:5} answers {average_time:>7}  '
+                     f'{tenant.questions_bank.question(qid)}')
+    lines.append('\nAccuracy by category:')
+    for category, (answered, correct_rate) in sorted(stats.accuracy_by_category().items()):
+        lines.append(f'{correct_rate:7.1%} of {answered:5} answers  {category or "Uncategorized"}')
+    lines.append('\nActive players per hour:')
+    for hour, active in stats.active_players():
+        lines.append(f'{time.strftime("%d/%m/%y %H:00", time.localtime(hour * 3600))}  {active:5} players')
+
+    data_to_send = {'result': 'ACK', 'protocol': 'server', 'msg': '\n'.join(lines)}
+    return 'analytics_callback', json.dumps(data_to_send)
+
+
+def is_manager_sid(sid) -> bool:
+    """
+    :return: True if the session belongs to a logged-in manager
+    """
+    if sid not in sessions:
+        return False
+    tenant, index = sessions[sid]
+    return bool(tenant.players.at[index, 'is_manager'])
+
+
+def start_profile_handler(sid, data: str) -> tuple[Response, int]:
+    """
+    starts a profiling session for a manager, the transport calls finish_profile when it's over
+    :return: the response, and the seconds to profile for (0 if the session didn't start)
+    """
+    if not is_manager_sid(sid):
+        logging.info(msg=f'{sid} tried to profile the server without permission')
+        return build_error('Access Denied.'), 0
+    try:
+        seconds = int(json.loads(data)['seconds'])
+    except (TypeError, ValueError, KeyError):
+        return build_error('can\'t parse data'), 0
+    seconds = min(max(seconds, 1), profiling_hooks.MAX_PROFILE_SECONDS)
+
+    if not profiler.start():
+        return build_error('A profiling session is already running.'), 0
+    logging.info(msg=f'profiling the server for {seconds} seconds')
+    data_to_send = {'result': 'ACK', 'protocol': 'server', 'msg': f'Profiling the server for {seconds} seconds...'}
+    return ('profile_callback', json.dumps(data_to_send)), seconds
+
+
+def finish_profile() -> Response:
+    path, report = profiler.stop()
+    logging.info(msg=f'profile report written to {path}')
+    data_to_send = {'result': 'ACK', 'protocol': 'server', 'path': path, 'msg': report}
+    return 'profile_report_callback', json.dumps(data_to_send)
+
+
+# the transport-agnostic handlers, by the socket-io event they serve
+HANDLERS = {
+    'login': login_handler,
+    'resume': resume_handler,
+    'play_question': play_question_handler,
+    'answer': answer_handler,
+    'server_stats': get_stats_handler,
+    'server_highscore': get_highscore_handler,
+    'server_add_question': add_question_handler,
+    'logged_in_users': get_logged_in_users_handler,
+    'register_player': register_player_handler,
+    'server_throttle_stats': get_throttle_stats_handler,
+    'server_analytics': get_analytics_handler,
+}